@@ -0,0 +1,302 @@
+"""
+Benchmarks of the SMT overhead with a fake solver and synthetic restart files
+
+Builds a quasi-steady-hydrograph project in a temporary folder, with templates, smt.yml,
+a central_database of partitioned restart files and a fake solver writing restart files,
+and times runsim.runner, model.get_input, model.adapt, model.finalize, tools.netcdf_copy
+and SpatialInterpolation, and the startup time of runsim.py. Runs offline, results are 
+saved in benchmarks/results as JSON.
+
+Usage: python benchmark.py run [OPTIONS]
+       python benchmark.py compare RESULT_FILE RESULT_FILE
+       python benchmark.py startup [OPTIONS]
+"""
+
+# load libraries
+import io
+import os
+import sys
+import json
+import time
+import shutil
+import logging
+import contextlib
+import platform
+import statistics
+import subprocess
+import tempfile
+from datetime import datetime
+import click
+import numpy as np
+import netCDF4
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(BENCHMARK_DIR), 'src')
+RESULTS_DIR = os.path.join(BENCHMARK_DIR, 'results')
+
+# target for the median startup time of runsim.py --help in seconds
+STARTUP_TARGET = 0.5
+
+MDU_TEMPLATE = '''TStart = ${TStart}
+TStop = ${TStop}
+DtUser = ${DtUserModel}
+OutputDir = ${OutputDir}
+RestartDateTimeStop = ${RestartDateTimeStop}
+RestartFile = ${RestartFile}
+Partitions = ${ProcessesString}
+MapInterval = ${MapInterval}
+HisInterval = ${HisInterval}
+'''
+
+# writes a restart file per partition with the same variables as the synthetic database
+FAKE_SOLVER = '''import os, sys, numpy as np, netCDF4
+settings = dict(line.split(' = ', 1) for line in open(os.path.join('dflowfm', sys.argv[1])).read().splitlines())
+output_dir = os.path.join('dflowfm', settings['OutputDir'])
+os.makedirs(output_dir, exist_ok=True)
+for partition in settings['Partitions'].split():
+    partition_string = '' if settings['Partitions'] == '0' else f'_{int(partition):04}'
+    with netCDF4.Dataset(os.path.join(output_dir, f'model{partition_string}_{settings["RestartDateTimeStop"]}_rst.nc'), 'w') as dataset:
+        dataset.createDimension('time', None)
+        dataset.createDimension('nFlowElem', CELLS)
+        for name in VARIABLES:
+            dataset.createVariable(name, 'f8', ('time', 'nFlowElem'))[:] = np.random.rand(1, CELLS)
+print('fake solver done', sys.argv[1:])
+'''
+
+def restart_variables(variables):
+    """Names of the variables in the synthetic restart files"""
+    names = ['s1', 'ucx', 'ucy', 'bl']
+    return (names + [f'var{number}' for number in range(len(names), variables)])[:max(variables, 1)]
+
+def write_restart_file(filename, cells, variables):
+    """Synthetic restart file with variables of cells values"""
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with netCDF4.Dataset(filename, 'w') as dataset:
+        dataset.createDimension('time', None)
+        dataset.createDimension('nFlowElem', cells)
+        for name in restart_variables(variables):
+            dataset.createVariable(name, 'f8', ('time', 'nFlowElem'))[:] = np.random.rand(1, cells)
+
+def make_project(folder, partitions, cells, variables, steps, levels, partition_workers):
+    """Synthetic quasi-steady-hydrograph project with a central_database for every discharge level"""
+    os.makedirs(os.path.join(folder, 'source', 'dflowfm'))
+    with open(os.path.join(folder, 'source', 'dflowfm', 'model.mdu.template'), 'w') as f:
+        f.write(MDU_TEMPLATE)
+    with open(os.path.join(folder, 'source', 'fake_solver.py'), 'w') as f:
+        f.write(FAKE_SOLVER.replace('CELLS', str(cells)).replace('VARIABLES', str(restart_variables(variables))))
+
+    discharges = [1000*(1 + step % levels) for step in range(steps)]
+    with open(os.path.join(folder, 'hydrograph.csv'), 'w') as f:
+        f.write('Q, TimeDuration\n')
+        for discharge in discharges:
+            f.write(f'{discharge}, 24\n')
+
+    smt_settings = {'model': {'simulation_type': 'quasi-steady-hydrograph',
+                              'input': 'model.mdu',
+                              'DIMR_dflowfm_workdir': 'dflowfm',
+                              'load_from_database': True,
+                              'partition_workers': partition_workers,
+                              'exclude_from_database': ['s1']},
+                    'application': {'input': ['.mdu'],
+                                    'command': {platform.system(): [sys.executable, 'fake_solver.py']},
+                                    'flags': {platform.system(): []}},
+                    'variables': {'automatic': None,
+                                  'user': {'from_file': 'hydrograph.csv',
+                                           'nNodes': 1,
+                                           'nProc': partitions,
+                                           'TUnit': 'H',
+                                           'DtUser': 3600,
+                                           'HisIntervalStep': 600,
+                                           'ReferenceDate': '20200101',
+                                           'OutputDir': 'output',
+                                           'SpinupTime': [0, 3600, 7200, 7200]}}}
+    with open(os.path.join(folder, 'smt.yml'), 'w') as f:
+        json.dump(smt_settings, f, indent=1)   # JSON is valid YAML
+
+    for discharge in sorted(set(discharges)):
+        for partition in range(partitions):
+            partition_string = '' if partitions == 1 else f'_{partition:04}'
+            write_restart_file(os.path.join(folder, 'central_database', 'dflowfm', f'model{partition_string}_{discharge}_rst.nc'),
+                               cells, variables)
+
+def timed(function, repeat=1, setup=None):
+    """Wall times of repeat calls of function, after calling setup before each call"""
+    times = []
+    for _ in range(repeat):
+        if setup != None:
+            setup()
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {'min': min(times), 'median': statistics.median(times), 'times': times}
+
+def git_commit():
+    """Commit of the SMT repository, 'unknown' outside a git repository"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=BENCHMARK_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def benchmark_startup(repeat):
+    """Time python runsim.py --help, which imports all modules needed by the runner"""
+    command = [sys.executable, os.path.join(SRC_DIR, 'runsim.py'), '--help']
+    return {'startup': timed(lambda: subprocess.run(command, check=True, capture_output=True), repeat)}
+
+def benchmark_runner(repeat):
+    """Time runsim.runner, get_input, adapt, finalize and netcdf_copy in the project folder"""
+    import runsim
+    import model
+    import tools
+
+    def clean():
+        for name in ['output', 'local_database']:
+            if os.path.exists(name):
+                shutil.rmtree(name)
+
+    timings = {}
+    timings['runner'] = timed(lambda: runsim.runner.main(['-s', 'smt.yml'], standalone_mode=False), repeat, clean)
+
+    smt_settings = model.read('smt.yml')
+    timings['get_input'] = timed(lambda: list(model.get_input(smt_settings)), repeat)
+
+    # second step: restart from central_database and the output of the first step
+    model_settings = list(model.get_input(smt_settings))[1]
+    workdir = os.path.join('output', 'benchmark_work')
+    def stage():
+        if os.path.exists(workdir):
+            shutil.rmtree(workdir)
+        tools.stage('source', workdir)
+    timings['adapt'] = timed(lambda: model.adapt(model_settings, smt_settings, workdir), repeat, stage)
+
+    def solve():
+        subprocess.run(smt_settings['application']['command'][platform.system()] + [smt_settings['model']['input']],
+                       cwd=workdir, check=True, capture_output=True)
+    timings['finalize'] = timed(lambda: model.finalize(model_settings, smt_settings, workdir), repeat, solve)
+
+    restart_file = sorted(os.listdir(os.path.join('central_database', 'dflowfm')))[0]
+    timings['netcdf_copy'] = timed(lambda: tools.netcdf_copy(os.path.join('central_database', 'dflowfm', restart_file),
+                                                             os.path.join('output', 'benchmark_copy', restart_file),
+                                                             smt_settings['model']['exclude_from_database']), repeat)
+    return timings
+
+def benchmark_interpolation(points, targets, maxdistance, repeat):
+    """Time SpatialInterpolation on a synthetic point cloud"""
+    import pandas as pd
+    from interpolation import SpatialInterpolation
+
+    random = np.random.default_rng(0)
+    size = np.sqrt(points)   # on average one point per square metre
+    xyz = pd.DataFrame({'x': random.uniform(0, size, points),
+                        'y': random.uniform(0, size, points),
+                        'bedlevel': random.normal(size=points)})
+    xiyi = pd.DataFrame({'x': random.uniform(0, size, targets),
+                         'y': random.uniform(0, size, targets)})
+
+    def interpolate(**kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            interpolation = SpatialInterpolation(xiyi, xyz, maxdistance, **kwargs)
+            interpolation.interpolate('idw')
+
+    return {'interpolation_radius': timed(interpolate, repeat),
+            'interpolation_knn': timed(lambda: interpolate(k=8), repeat)}
+
+@click.group()
+def cli():
+    pass
+
+@cli.command()
+@click.option('--partitions', default=4, help='Number of partitions (default = 4)')
+@click.option('--cells', default=100000, help='Number of cells per partition in the restart files (default = 100000)')
+@click.option('--variables', default=8, help='Number of variables in the restart files (default = 8)')
+@click.option('--steps', default=6, help='Number of hydrograph steps (default = 6)')
+@click.option('--levels', default=3, help='Number of discharge levels in the hydrograph (default = 3)')
+@click.option('--partition-workers', default=1, help='partition_workers setting of the project (default = 1)')
+@click.option('--points', default=1000000, help='Number of points of the interpolation point cloud (default = 1000000)')
+@click.option('--targets', default=100000, help='Number of points to interpolate to (default = 100000)')
+@click.option('--maxdistance', default=2., help='Interpolation radius (default = 2)')
+@click.option('--repeat', default=3, help='Number of repetitions per benchmark (default = 3)')
+@click.option('--keep', is_flag=True, help='Keep the synthetic project folder')
+@click.option('-o', '--output', default=None, help='Result file (default = results/<date>_<commit>.json)')
+def run(partitions, cells, variables, steps, levels, partition_workers, points, targets, maxdistance, repeat, keep, output):
+    """Run the benchmarks and save the results"""
+    parameters = {'partitions': partitions, 'cells': cells, 'variables': variables, 'steps': steps, 'levels': levels,
+                  'partition_workers': partition_workers, 'points': points, 'targets': targets,
+                  'maxdistance': maxdistance, 'repeat': repeat}
+    original_dir = os.getcwd()
+    folder = tempfile.mkdtemp(prefix='smt_benchmark_')
+    try:
+        make_project(folder, partitions, cells, variables, steps, levels, partition_workers)
+        os.chdir(folder)
+
+        # SMT modules are imported in the project folder, where the log file is written
+        sys.path.insert(0, SRC_DIR)
+        import runsim
+        logging.getLogger('SMT').setLevel(logging.WARNING)
+
+        timings = benchmark_startup(repeat)
+        timings.update(benchmark_runner(repeat))
+        timings.update(benchmark_interpolation(points, targets, maxdistance, repeat))
+    finally:
+        os.chdir(original_dir)
+        if keep:
+            click.echo(f'Project kept in {folder}')
+        else:
+            shutil.rmtree(folder)
+
+    commit = git_commit()
+    results = {'commit': commit,
+               'date': datetime.now().strftime('%Y-%m-%dT%H:%M:%S'),
+               'host': {'platform': platform.platform(), 'python': platform.python_version(),
+                        'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'netCDF4': netCDF4.__version__},
+               'parameters': parameters,
+               'timings': timings}
+    if output == None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f'{datetime.now().strftime("%Y%m%d_%H%M%S")}_{commit[:8]}.json')
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=1)
+
+    click.echo(f'{"benchmark":<22} {"min s":>10} {"median s":>10}')
+    for name, timing in timings.items():
+        click.echo(f'{name:<22} {timing["min"]:>10.3f} {timing["median"]:>10.3f}')
+    click.echo(f'Results written to {output}')
+
+@cli.command()
+@click.argument('baseline')
+@click.argument('result')
+def compare(baseline, result):
+    """Compare the median times of two result files"""
+    with open(baseline) as f:
+        baseline_results = json.load(f)
+    with open(result) as f:
+        results = json.load(f)
+    if baseline_results['parameters'] != results['parameters']:
+        click.echo('Warning: the results have different parameters')
+    click.echo(f'{"benchmark":<22} {baseline_results["commit"][:8]:>10} {results["commit"][:8]:>10} {"ratio":>8}')
+    for name, timing in results['timings'].items():
+        if name not in baseline_results['timings']:
+            continue
+        baseline_median = baseline_results['timings'][name]['median']
+        click.echo(f'{name:<22} {baseline_median:>10.3f} {timing["median"]:>10.3f} {timing["median"]/baseline_median:>8.2f}')
+
+@cli.command()
+@click.option('--repeat', default=10, help='Number of repetitions (default = 10)')
+@click.option('--target', default=STARTUP_TARGET, help=f'Maximum median startup time in seconds (default = {STARTUP_TARGET})')
+def startup(repeat, target):
+    """Check the startup time of runsim.py against a target, exits with 1 if it is slower"""
+    original_dir = os.getcwd()
+    folder = tempfile.mkdtemp(prefix='smt_benchmark_')
+    try:
+        # runsim.py writes its log file in the working folder
+        os.chdir(folder)
+        timing = benchmark_startup(repeat)['startup']
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(folder)
+    click.echo(f'runsim.py startup: min {timing["min"]:.3f} s, median {timing["median"]:.3f} s, target {target:.3f} s')
+    if timing['median'] > target:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    cli()
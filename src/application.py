@@ -2,21 +2,17 @@
 
 #load libraries
 import os
-#from subprocess import run, 
-from subprocess import Popen, PIPE, STDOUT, CompletedProcess, CalledProcessError
+import logging
+import asyncio
+from subprocess import CalledProcessError
 
 #load modules
-import tools 
+from executors import LocalExecutor
 
 global logger 
 
-# create logger
-logger = tools.init_logger()
-
-def log_subprocess_output(pipe):
-    # function to pass stdout to logger 
-    for line in iter(pipe.readline, b''): # b'\n'-separated lines
-        logger.debug('%s', line.decode().replace('\r\n',''))
+# logger, configured by tools.init_logger at the entry point
+logger = logging.getLogger('SMT')
 
 class Application():
     """Class for Application"""
@@ -26,12 +22,18 @@ class Application():
         self.run_script = kwargs.get('run_script', '')
         self.prep_script = kwargs.get('prep_script', '')
         self.run_flags = kwargs.get('run_flags', '')
+        self.timeout = kwargs.get('timeout', None)
+        self.log_file = kwargs.get('log_file', 'application.log')
+        self.executor = kwargs.get('executor', LocalExecutor())
 
     def __str__(self):
         return '\n'.join(['Application class', 
                           'run_script:' + self.run_script, 
                           'run_flags:' + self.run_flags, 
                           'prep_script:' + self.prep_script, 
+                          'timeout:' + str(self.timeout), 
+                          'log_file:' + self.log_file, 
+                          'executor:' + str(self.executor), 
                           ])
 
     def prep(self, workdir, prep_entry):
@@ -39,9 +41,13 @@ class Application():
         print(' '.join([self.prep_script, prep_entry]))
 
     def run(self, workdir, run_entry):
-        """Running routine for Application Class"""
-        original_dir = os.getcwd()
-        os.chdir(workdir)
+        """
+        Running routine for Application Class
+        The command runs in workdir with the executor (locally or as batch job) and its output 
+        is written to log_file in workdir. Raises TimeoutExpired after stopping the application 
+        if it runs longer than timeout seconds, and CalledProcessError if it exits with a 
+        non-zero exit code
+        """
         command = self.run_script.copy()
         if self.run_flags != None: 
             for flag in self.run_flags: 
@@ -50,13 +56,9 @@ class Application():
             command.append(run_entry)
         logger.info('Simulation starting')
         logger.info(' '.join(command))
-        process = Popen(command, stdout=PIPE, stderr=STDOUT)
-        with process.stdout:
-            log_subprocess_output(process.stdout)
-        exitcode = process.wait() # 0 means success
-        #process = run(command, capture_output=True)
-        #if exitcode != 0: 
-        #    raise CalledProcessError
+        log_file = os.path.join(workdir, self.log_file)
+        exitcode = asyncio.run(self.executor.run(command, workdir, log_file, self.timeout)) # 0 means success
+        if exitcode != 0: 
+            logger.error(f'Simulation failed with exit code {exitcode}, see {log_file}')
+            raise CalledProcessError(exitcode, command)
         logger.info('Simulation finished')
-        os.chdir(original_dir)
-
@@ -0,0 +1,250 @@
+"""Module containing the executors that run an Application command locally or as batch job"""
+
+#load libraries
+import os
+import logging
+import math
+import time
+import shlex
+import signal
+import asyncio
+from subprocess import TimeoutExpired
+
+global logger
+
+# logger, configured by tools.init_logger at the entry point
+logger = logging.getLogger('SMT')
+
+# number of bytes of application output read and buffered before writing to the log file
+LOG_BUFFER_SIZE = 1024*1024
+
+# file in the job folder with the exit code of the command of a batch job
+EXITCODE_FILE = 'smt_exitcode'
+
+# batch job script in the job folder
+JOB_SCRIPT = 'smt_job.sh'
+
+# attempts and timeout in seconds of the scheduler queries (squeue, sacct) before a job is given up
+QUERY_ATTEMPTS = 5
+QUERY_TIMEOUT = 60
+
+# sacct states of jobs that did not finish yet
+ACTIVE_STATES = ['PENDING', 'CONFIGURING', 'RUNNING', 'COMPLETING', 'SUSPENDED', 'REQUEUED', 
+                 'REQUEUE_HOLD', 'REQUEUE_FED', 'RESIZING', 'SIGNALING', 'STAGE_OUT', 'STOPPED']
+
+def get_executor(smt_settings):
+    """Executor for the application: executor setting in smt.yml, one of local (default), slurm or fake-slurm"""
+    application_settings = smt_settings['application']
+    name = application_settings.get('executor', 'local')
+    if name == 'local':
+        return LocalExecutor()
+
+    # job size from the partitioning of the model
+    user_settings = smt_settings['variables']['user']
+    slurm_settings = application_settings.get('slurm', {}) or {}
+    kwargs = {'nodes': user_settings.get('nNodes', 1),
+              'tasks_per_node': user_settings.get('nProc', 1),
+              'partition': slurm_settings.get('partition', None),
+              'options': slurm_settings.get('options', []),
+              'poll_interval': slurm_settings.get('poll_interval', 30 if name == 'slurm' else 1)}
+    if name == 'slurm':
+        return SlurmExecutor(**kwargs)
+    if name == 'fake-slurm':
+        return FakeSlurmExecutor(**kwargs)
+    raise ValueError('Executor not in [local, slurm, fake-slurm]')
+
+async def write_output(stream, log):
+    """Write the output stream of a process to the log file until the process closes it"""
+    while True:
+        data = await stream.read(LOG_BUFFER_SIZE)
+        if not data:
+            break
+        log.write(data)
+
+async def wait_process(process, log): 
+    """Write the output of a process to the log file and wait until it exits, returns the exit code"""
+    await write_output(process.stdout, log)
+    return await process.wait()
+
+async def check_output(*command, timeout=QUERY_TIMEOUT):
+    """Output of a command, None if it fails or does not finish within timeout seconds"""
+    try: 
+        process = await asyncio.create_subprocess_exec(*command, stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.DEVNULL)
+    except OSError: 
+        return None
+    try: 
+        output, _ = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError: 
+        logger.warning(f'{command[0]} did not finish within {timeout} s')
+        try: 
+            process.kill()
+        except ProcessLookupError: 
+            pass
+        await process.wait()
+        return None
+    if process.returncode != 0:
+        return None
+    return output.decode()
+
+def kill(process):
+    """Kill a process and, on POSIX, the processes it started (e.g. mpirun and the solver)"""
+    try: 
+        if os.name == 'posix':
+            os.killpg(process.pid, signal.SIGKILL)
+        else:
+            process.kill()
+    except ProcessLookupError: 
+        # already exited
+        pass
+
+class LocalExecutor():
+    """Runs the command as child process of SMT"""
+
+    def __str__(self):
+        return 'LocalExecutor'
+
+    async def run(self, command, workdir, log_file, timeout=None):
+        """Run command in workdir with its output written to log_file, returns the exit code"""
+        process = await asyncio.create_subprocess_exec(*command, cwd=workdir,
+                                                       stdout=asyncio.subprocess.PIPE,
+                                                       stderr=asyncio.subprocess.STDOUT,
+                                                       start_new_session=(os.name == 'posix'))
+        with open(log_file, 'wb', buffering=LOG_BUFFER_SIZE) as log:
+            try:
+                # the timeout covers the process itself, also when it closes its output early
+                return await asyncio.wait_for(wait_process(process, log), timeout)
+            except asyncio.TimeoutError:
+                logger.error(f'Simulation exceeded the timeout of {timeout} s, killing it')
+                kill(process)
+                await process.wait()
+                raise TimeoutExpired(command, timeout)
+
+class SlurmExecutor():
+    """
+    Submits the command as SLURM batch job with sbatch and polls squeue until it left the queue
+    The job gets nodes nodes with tasks_per_node tasks each. The timeout applies to the running
+    job, not to the time in the queue, and is passed to SLURM as time limit as well.
+    """
+
+    def __init__(self, nodes=1, tasks_per_node=1, partition=None, options=[], poll_interval=30):
+        self.nodes = nodes
+        self.tasks_per_node = tasks_per_node
+        self.partition = partition
+        self.options = options
+        self.poll_interval = poll_interval
+
+    def __str__(self):
+        return f'{type(self).__name__} nodes={self.nodes} tasks_per_node={self.tasks_per_node} partition={self.partition}'
+
+    def job_script(self, command, log_file, timeout=None):
+        """Batch script running command and writing its exit code to EXITCODE_FILE"""
+        lines = ['#!/bin/bash',
+                 '#SBATCH --job-name=smt',
+                 f'#SBATCH --nodes={self.nodes}',
+                 f'#SBATCH --ntasks-per-node={self.tasks_per_node}',
+                 f'#SBATCH --output={os.path.abspath(log_file)}']
+        if self.partition != None:
+            lines.append(f'#SBATCH --partition={self.partition}')
+        if timeout != None:
+            lines.append(f'#SBATCH --time={math.ceil(timeout/60)}')
+        lines += [f'#SBATCH {option}' for option in self.options]
+        lines += [shlex.join(command),
+                  f'echo $? > {EXITCODE_FILE}',
+                  '']
+        return '\n'.join(lines)
+
+    async def submit(self, script, workdir, log_file):
+        """Submit the job script in workdir, returns the job id"""
+        output = await check_output('sbatch', '--parsable', f'--chdir={os.path.abspath(workdir)}', script)
+        if output == None:
+            raise RuntimeError(f'Submitting {script} with sbatch failed')
+        return output.strip().split(';')[0]
+
+    async def job_state(self, job_id):
+        """
+        State of the job (e.g. PENDING or RUNNING), None if it left the queue
+        Failing queries are retried with backoff, raises RuntimeError if the state stays unknown
+        """
+        for attempt in range(QUERY_ATTEMPTS):
+            output = await check_output('squeue', '--noheader', f'--jobs={job_id}', '--format=%T')
+            if output != None:
+                if output.strip() != '':
+                    return output.strip()
+                return None
+            # squeue also fails for jobs that left the queue a while ago, ask the accounting
+            output = await check_output('sacct', '--noheader', '--parsable2', '--allocations', 
+                                        f'--jobs={job_id}', '--format=State')
+            if output != None and output.strip() != '':
+                state = output.strip().splitlines()[0].split(' ')[0]
+                return state if state in ACTIVE_STATES else None
+            delay = self.poll_interval*2**attempt
+            logger.warning(f'State of job {job_id} unknown, squeue and sacct failed, retrying in {delay} s')
+            await asyncio.sleep(delay)
+        raise RuntimeError(f'State of job {job_id} unknown after {QUERY_ATTEMPTS} attempts')
+
+    async def cancel(self, job_id):
+        """Cancel the job"""
+        await check_output('scancel', job_id)
+
+    async def run(self, command, workdir, log_file, timeout=None):
+        """Run command as batch job in workdir with its output written to log_file, returns the exit code"""
+        script = os.path.abspath(os.path.join(workdir, JOB_SCRIPT))
+        with open(script, 'w', newline='\n') as f:
+            f.write(self.job_script(command, log_file, timeout))
+        exitcode_file = os.path.join(workdir, EXITCODE_FILE)
+        if os.path.exists(exitcode_file):
+            os.remove(exitcode_file)
+
+        job_id = await self.submit(script, workdir, log_file)
+        logger.info(f'Submitted job {job_id}')
+        start_time = None
+        while True:
+            state = await self.job_state(job_id)
+            if state == None:
+                break
+            if state == 'RUNNING' and start_time == None:
+                logger.info(f'Job {job_id} running')
+                start_time = time.monotonic()
+            if timeout != None and start_time != None and time.monotonic() - start_time > timeout:
+                logger.error(f'Job {job_id} exceeded the timeout of {timeout} s, cancelling it')
+                await self.cancel(job_id)
+                raise TimeoutExpired(command, timeout)
+            await asyncio.sleep(self.poll_interval)
+
+        if not os.path.exists(exitcode_file):
+            # cancelled, time limit or node failure
+            logger.error(f'Job {job_id} ended without exit code')
+            return -1
+        with open(exitcode_file) as f:
+            return int(f.read().strip())
+
+class FakeSlurmExecutor(SlurmExecutor):
+    """
+    SlurmExecutor with a local stand-in for sbatch, squeue and scancel,
+    which runs the job script with bash. For testing batch runs without a cluster.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.jobs = {}
+
+    async def submit(self, script, workdir, log_file):
+        with open(log_file, 'wb') as log:
+            process = await asyncio.create_subprocess_exec('bash', script, cwd=workdir,
+                                                           stdout=log, stderr=asyncio.subprocess.STDOUT,
+                                                           start_new_session=(os.name == 'posix'))
+        job_id = str(process.pid)
+        self.jobs[job_id] = process
+        return job_id
+
+    async def job_state(self, job_id):
+        if self.jobs[job_id].returncode == None:
+            return 'RUNNING'
+        del self.jobs[job_id]
+        return None
+
+    async def cancel(self, job_id):
+        process = self.jobs.pop(job_id)
+        kill(process)
+        await process.wait()
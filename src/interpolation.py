@@ -8,72 +8,107 @@ For kinging or rbf, use dask: https://stackoverflow.com/questions/51651956/memor
 
 """
 
+import os
+import mmap
+import hashlib
+import tempfile
+import tools
 import pandas as pd
 import numpy as np
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from scipy import spatial
+from scipy import sparse
 import warnings
 from scipy.spatial import distance
 from scipy.spatial import cKDTree as KDTree 
 
+# record of the binary xyz cache, see load_xyz
+XYZ_DTYPE = np.dtype([('x', '<f8'), ('y', '<f8'), ('bedlevel', '<f8')])
+
 class SpatialInterpolation(object):
     
-    def __init__(self, xiyi, xyz, maxdistance= 20.):
+    def __init__(self, xiyi, xyz, maxdistance= 20., k=None, cache_dir=None, prefilter='bbox'):
         """
         Input:  xiyi:         location_to_interpolate
                               dataframe containing 2 columns should be named: 'x', 'y'.
                 xyz:          dataframe used in the interpolation. 
                               Columnnames should contain: 'x', 'y', 'bedlevel'
+                              or memory-mapped xyz file, see load_xyz
                 maxdistance:  float value (in meters) that indicates maximum distance between 
                               and data_to_interpolate. 
+                k:            number of nearest xyz points used for each xiyi point (within maxdistance). 
+                              Default None uses all xyz points within maxdistance.
+                cache_dir:    folder to store the distance matrix and weight matrices, keyed by a hash of 
+                              the xiyi and xyz coordinates, maxdistance and k. Default None does not cache.
+                prefilter:    selection of xyz points before building the kd-tree, one of 
+                              'bbox' - points within maxdistance of the bounding box of xiyi (default)
+                              'hash' - points in or next to a cell of size maxdistance containing xiyi points, 
+                                       for curved or narrow grids
+                              None   - all points
                               
         Ouptut: 
                  self.xiyi      - stored xiyi data
                  self.xyz       - stored xyz data
-                 self.xiyi_tree = kd-tree of xi,yi point pairs for interpolation
-                 self.xyz_tree  = kd-tree of x,y,z points with raw data
-                 self.dist      = sparse distance matrix between xi,yi and x,y. 
+                 self.xiyi_tree = kd-tree of xi,yi point pairs for interpolation (None if k is set)
+                 self.xyz_tree  = kd-tree of the prefiltered x,y points with raw data
+                 self.dist      = sparse distance matrix (coo) between xi,yi and x,y. 
+                 
+                 For several fields with the same weights, see interpolate_fields
         """
         self.distance = maxdistance
         
-        # Selection of points in the grid within a distance given by maxdistance.       
-        a = xiyi[['x', 'y']]
-        b = xyz[['x', 'y']]
-        xmin = np.min(a['x'])
-        ymin = np.min(a['y'])
-        xmax = np.max(a['x'])
-        ymax = np.max(a['y'])
-        
-        #b = b.drop(b[b['x'] < xmin - maxdistance].index)
-        #b = b.drop(b[b['y'] < ymin - maxdistance].index)
-        #b = b.drop(b[b['x'] > xmax + maxdistance].index)
-        #b = b.drop(b[b['y'] > ymax + maxdistance].index)
+        a = np.column_stack((np.asarray(xiyi['x'], dtype=float), np.asarray(xiyi['y'], dtype=float)))
         print('Length xiyi:', len(a))
-        print('Length xyz:', len(b))
-
-        #steps = 20
-        #dx = (xmax-xmin) / steps
-        #for k in range(steps): 
-        #    a2 = a.copy()
-        #    b2 = b.copy()
-        #    xlow = xmin + k*dx
-        #    xhigh = xmin + (k+1)*dx
-        #    a2 = a2.drop(a2[a2['x'] < xlow].index)
-        #    a2 = a2.drop(a2[a2['x'] > xhigh].index)
-        #    b2 = b2.drop(b2[b2['x'] < xlow - maxdistance].index)
-        #    b2 = b2.drop(b2[b2['x'] > xhigh + maxdistance].index)
-        #
-        #    # Building the trees 
-        #    print('Length xiyi step', k, '/', steps, ':', len(a2))
-        #    print('Length xyz: step', k, '/', steps, ':', len(b2))
-        #    
+        print('Length xyz:', len(xyz))
+
+        # For point clouds larger than memory, see interpolate_tiled
+        self.cache_dir = cache_dir
+        self.cache_key = None
+        dist = None
+        if cache_dir != None: 
+            self.cache_key = geometry_key(a, xyz, maxdistance, k)
+            filename = os.path.join(cache_dir, f'neighbours_{self.cache_key}.npz')
+            if os.path.exists(filename): 
+                print(f'Loading distance matrix from {filename}\n')
+                dist = sparse.load_npz(filename).tocoo()
+                atree = None
+                btree = None
+
         leafsize=16 #16=default 
-        print('Building kd-tree (1/2)')
-        atree = KDTree( a.values, leafsize = leafsize, balanced_tree=False)  # build the tree
-        print('Building kd-tree (2/2)')
-        btree = KDTree( b.values, leafsize = leafsize, balanced_tree=False)  # build the tree
-        
-        print('Building distance matrix\n')
-        dist = atree.sparse_distance_matrix(btree, maxdistance)
+        if dist is None: 
+            # Selection of points in the grid within a distance given by maxdistance, 
+            # read chunk by chunk so only the selected points of a memory-mapped xyz file are loaded
+            source, b = prefilter_points(a, xyz, maxdistance, prefilter)
+            print('Length xyz after prefilter:', len(b))
+
+            if k == None: 
+                print('Building kd-tree (1/2)')
+                atree = KDTree( a, leafsize = leafsize, balanced_tree=False)  # build the tree
+                print('Building kd-tree (2/2)')
+                btree = KDTree( b, leafsize = leafsize, balanced_tree=False)  # build the tree
+            
+                print('Building distance matrix\n')
+                dist = atree.sparse_distance_matrix(btree, maxdistance, output_type='coo_matrix')
+            else: 
+                atree = None
+                print('Building kd-tree')
+                btree = KDTree( b, leafsize = leafsize, balanced_tree=False)  # build the tree
+
+                print(f'Querying {k} nearest neighbours\n')
+                # distance_upper_bound is exclusive, the distance matrix includes points at maxdistance
+                d, j = btree.query(a, k=k, distance_upper_bound=np.nextafter(maxdistance, np.inf), workers=-1)
+                d = d.reshape(len(a), k)
+                j = j.reshape(len(a), k)
+                valid = j < len(b)   # missing neighbours have index len(b)
+                i = np.broadcast_to(np.arange(len(a))[:, np.newaxis], j.shape)
+                dist = sparse.coo_matrix((d[valid], (i[valid], j[valid])), shape=(len(a), len(b)))
+
+            # column index of the selected xyz points to index in xyz
+            dist = sparse.coo_matrix((dist.data, (dist.row, source[dist.col])), shape=(len(a), len(xyz)))
+            if cache_dir != None: 
+                os.makedirs(cache_dir, exist_ok=True)
+                save_npz(os.path.join(cache_dir, f'neighbours_{self.cache_key}.npz'), dist)
         #print(dist.keys())
         
         #pdb.set_trace()
@@ -86,11 +121,26 @@ class SpatialInterpolation(object):
         self.dist      = dist
         
         self.maxdistance = maxdistance
+        self.ugrid_file = None
+        self.ugrid_location = None
+
+    @classmethod
+    def from_ugrid(cls, netcdf_file, xyz, location='node', **kwargs): 
+        """
+        Interpolation onto the nodes or faces of the 2D mesh in a UGRID netCDF file (_net.nc, _map.nc or _rst.nc)
+        location: 'node' or 'face', other arguments as in __init__
+        The result can be written back into the file with result_to_ugrid
+        """
+        x, y = tools.ugrid_coordinates(netcdf_file, location)
+        interpolation = cls(pd.DataFrame({'x': x, 'y': y}), xyz, **kwargs)
+        interpolation.ugrid_file = netcdf_file
+        interpolation.ugrid_location = location
+        return interpolation
                 
-    def interpolate(self, method='idw'):
+    def interpolate(self, method='idw', power=1.):
         self.method = method
         if method == 'idw': 
-            self.interpolate_idw()
+            self.interpolate_idw(power)
         elif method == 'mean': 
             self.interpolate_mean()
         elif method == 'gaussian': 
@@ -98,82 +148,81 @@ class SpatialInterpolation(object):
         else: 
             raise ValueError("Interpolation method not in [idw, mean, gaussian]")    
 
-    def interpolate_idw(self):
+    def interpolate_idw(self, power=1.):
         """
-        Perform inverse distance weighting
+        Perform inverse distance weighting, weights ~ 1 / distance**power
         Result is stored in self.result
         """
-        index = [j for j in self.dist.keys()]
-        a_index = [j[0] for j in index]
-        b_index = [j[1] for j in index]
-        di = [1/self.dist[j] for j in index]
-        bldi = [self.xyz['bedlevel'][j[1]]/self.dist[j] for j in index] 
-
-        df = pd.DataFrame({"i":a_index, 
-                           "j":b_index, 
-                           "di":di,
-                           "bldi":bldi})
-        
-        table = pd.pivot_table(df, values=['di','bldi'], index=['i'],
-                                columns=[], aggfunc={'di': np.sum,
-                                                     'bldi': np.sum})
-        
-        table['idw'] = [table['bldi'][j]/table['di'][j] for j in table.index]
-        self.result = table['idw']
+        self.result = self.apply_weights(self.weight_matrix('idw', power), 'bedlevel', 'idw')
      
     def interpolate_mean(self):
         """
         Perform mean bed level
         Result is stored in self.result
         """
-        index = [j for j in self.dist.keys()]
-        a_index = [j[0] for j in index]
-        b_index = [j[1] for j in index]
-        bl = [self.xyz['bedlevel'][j[1]] for j in index] 
-        
-        df = pd.DataFrame({"i":a_index, 
-                           "j":b_index, 
-                           "bl":bl})
-        
-        table = pd.pivot_table(df, values=['bl'], index=['i'],
-                                columns=[], aggfunc={'bl': np.mean})
-        
-        #print(table.head())
-        table['mean'] = [table['bl'][j] for j in table.index]
-        self.result = table['mean']
-        
-        #print(self.result.head())
-        #plt.scatter(self.xiyi['x'][a_index],self.xiyi['y'][a_index],c=df['bl'])
-        #plt.show()
-        #pdb.set_trace()
+        self.result = self.apply_weights(self.weight_matrix('mean'), 'bedlevel', 'mean')
         
     def interpolate_gaussian(self):
         """
         Perform weighting by gaussian weighting function
         Result is stored in self.result
         """
-        index = [j for j in self.dist.keys()]
-        a_index = [j[0] for j in index]
-        b_index = [j[1] for j in index]
-        
-        def weight_function(d,mu=0.0,sigma=self.maxdistance/2.0): 
-            return np.exp(-np.floatpower(d-mu,2.0)/(2.0*sigma))
-        
-        wi = [weight_function(self.dist[j]) for j in index]
-        blwi = [self.xyz['bedlevel'][j[1]]*weight_function(self.dist[j]) for j in index] 
+        self.result = self.apply_weights(self.weight_matrix('gaussian'), 'bedlevel', 'gaussian')
 
-        df = pd.DataFrame({"i":a_index, 
-                           "j":b_index, 
-                           "wi":wi,
-                           "blwi":blwi})
-        
-        table = pd.pivot_table(df, values=['wi','blwi'], index=['i'],
-                                columns=[], aggfunc={'wi': np.sum,
-                                                     'blwi': np.sum})
-        
-        table['gaussian'] = [table['blwi'][j]/table['wi'][j] for j in table.index]
-        self.result = table['gaussian']
+    def weight_matrix(self, method, power=1.):
+        """
+        Sparse matrix with the normalised weights of the xyz points (columns) 
+        for each of the xiyi points (rows), for method in [idw, mean, gaussian]
+        power is the exponent of the distance for idw
+        With a cache_dir, the weight matrix is stored and reused for the same geometry
+        """
+        if self.cache_dir != None: 
+            filename = os.path.join(self.cache_dir, f'weights_{self.cache_key}_{method}_{power}.npz')
+            if os.path.exists(filename): 
+                return sparse.load_npz(filename)
+
+        d = self.dist.data
+        if method == 'idw': 
+            w = 1/d if power == 1. else 1/np.float_power(d, power)
+        elif method == 'mean': 
+            w = np.ones_like(d)
+        elif method == 'gaussian': 
+            mu = 0.0
+            sigma = self.maxdistance/2.0
+            w = np.exp(-np.float_power(d-mu,2.0)/(2.0*sigma))
+        else: 
+            raise ValueError("Interpolation method not in [idw, mean, gaussian]")    
         
+        w_sum = np.bincount(self.dist.row, weights=w, minlength=self.dist.shape[0])
+        weights = sparse.csr_matrix((w/w_sum[self.dist.row], (self.dist.row, self.dist.col)), shape=self.dist.shape)
+        if self.cache_dir != None: 
+            save_npz(filename, weights)
+        return weights
+
+    def interpolate_fields(self, fields, method='idw', power=1.):
+        """
+        Interpolate several fields of xyz (e.g. 'bedlevel', 'd50', 'd90') with the same weights
+        Result is stored in self.results, a dataframe with a column per field
+        """
+        self.method = method
+        self.results = self.apply_weights(self.weight_matrix(method, power), fields)
+        return self.results
+
+    def apply_weights(self, weights, fields, name=None):
+        """
+        Interpolate fields of xyz with the weight matrix, in a single sparse matrix product
+        Returns dataframe indexed by the xiyi points that have xyz points within maxdistance, 
+        or a series with the given name if fields is a single field
+        Only the xyz points with a weight are read, e.g. from a memory-mapped xyz file
+        """
+        index = np.flatnonzero(np.diff(weights.indptr))
+        columns = np.unique(weights.indices)
+        weights = weights[index][:, columns]
+        if isinstance(fields, str): 
+            values = weights @ xyz_values(self.xyz, [fields], columns)[0]
+            return pd.Series(values, index=pd.Index(index, name='i'), name=name)
+        values = weights @ np.column_stack(xyz_values(self.xyz, fields, columns))
+        return pd.DataFrame(values, index=pd.Index(index, name='i'), columns=fields)
         
     def result_to_csv(self, csvfilename):
          d = {'xi': self.xiyi['x'][self.result.index], 
@@ -182,6 +231,79 @@ class SpatialInterpolation(object):
          df = pd.DataFrame(data=d)
          df.to_csv(csvfilename)
 
+    def result_arrays(self, field=None): 
+        """
+        Arrays xi, yi, zi of the xiyi points with a result, shared by the binary writers
+        field selects a column of self.results (see interpolate_fields) instead of self.result
+        No copies are made if all xiyi points have a result
+        """
+        result = self.result if field == None else self.results[field]
+        zi = result.to_numpy(dtype=float)
+        xi = np.asarray(self.xiyi['x'], dtype=float)
+        yi = np.asarray(self.xiyi['y'], dtype=float)
+        if len(result) != len(xi): 
+            positions = result.index.to_numpy()
+            xi = xi[positions]
+            yi = yi[positions]
+        return xi, yi, zi
+
+    def result_to_npy(self, filename, field=None): 
+        """Write the result as n x 3 array with columns xi, yi, zi to a NumPy .npy file"""
+        xi, yi, zi = self.result_arrays(field)
+        data = np.empty((len(zi), 3))
+        data[:, 0] = xi
+        data[:, 1] = yi
+        data[:, 2] = zi
+        np.save(filename, data)
+
+    def result_to_npz(self, filename, field=None, compressed=False): 
+        """Write the result as arrays xi, yi, zi to a NumPy .npz file"""
+        xi, yi, zi = self.result_arrays(field)
+        save = np.savez_compressed if compressed else np.savez
+        save(filename, xi=xi, yi=yi, zi=zi)
+
+    def result_to_parquet(self, filename, field=None): 
+        """Write the result with columns xi, yi, zi to a Parquet file (requires pyarrow)"""
+        try: 
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError: 
+            raise ImportError('result_to_parquet requires pyarrow')
+        xi, yi, zi = self.result_arrays(field)
+        pyarrow.parquet.write_table(pyarrow.table({'xi': xi, 'yi': yi, 'zi': zi}), filename)
+
+    def result_to_xyz(self, filename, field=None, fmt='%.15g', buffer_points=1000000): 
+        """
+        Write the result to a D-Flow FM sample file (.xyz) with lines 'xi yi zi', 
+        formatted buffer_points at a time in a preallocated buffer
+        """
+        xi, yi, zi = self.result_arrays(field)
+        buffer = np.empty((min(buffer_points, len(zi)), 3))
+        with open(filename, 'w') as f: 
+            for start in range(0, len(zi), buffer_points): 
+                stop = min(start + buffer_points, len(zi))
+                chunk = buffer[:stop - start]
+                chunk[:, 0] = xi[start:stop]
+                chunk[:, 1] = yi[start:stop]
+                chunk[:, 2] = zi[start:stop]
+                np.savetxt(f, chunk, fmt=fmt, delimiter=' ')
+
+    def result_to_ugrid(self, variable, netcdf_file=None, location=None, field=None): 
+        """
+        Write the result in place into variable (e.g. 'mesh2d_node_z') of a UGRID netCDF file, 
+        by default the file and location used in from_ugrid
+        field selects a column of self.results (see interpolate_fields) instead of self.result
+        xiyi points without xyz points within maxdistance keep the value of an existing variable
+        """
+        netcdf_file = netcdf_file if netcdf_file != None else self.ugrid_file
+        location = location if location != None else self.ugrid_location
+        if netcdf_file == None or location == None: 
+            raise ValueError('No UGRID file and location, use from_ugrid or give netcdf_file and location')
+        result = self.result if field == None else self.results[field]
+        values = np.full(len(self.xiyi), np.nan)
+        values[result.index] = result.values
+        tools.ugrid_write(netcdf_file, variable, values, location)
+
     def result_to_m_n_grid(self):
         #if len(self.result) > 0: 
         #print(self.result)
@@ -345,5 +467,251 @@ class SpatialInterpolation(object):
         # self.results['interpolated_bedlevel'] = interpolation.reshape(len(interpolation), 1) 
         # #print ( self.results.keys() )
         # return self.results
+
+
+def prefilter_points(xiyi, xyz, maxdistance, prefilter='bbox', chunksize=1000000): 
+    """
+    Positions of the points in xyz that can be within maxdistance of a point in xiyi (m x 2 array) 
+    and their coordinates (n x 2 array), selected chunksize points at a time (see xyz_chunks)
+    prefilter: 'bbox', 'hash' or None, see SpatialInterpolation
+    """
+    if prefilter not in ['bbox', 'hash', None]: 
+        raise ValueError("Prefilter not in [bbox, hash, None]")
+    if len(xiyi) > 0: 
+        xmin, ymin = xiyi.min(axis=0) - maxdistance
+        xmax, ymax = xiyi.max(axis=0) + maxdistance
+    if prefilter == 'hash' and maxdistance > 0 and len(xiyi) > 0: 
+        # cells of size maxdistance, a point within maxdistance is in the same or a neighbouring cell
+        origin = np.array([xmin, ymin])
+        ncells = int(np.floor((ymax - ymin)/maxdistance)) + 3
+        target_cells = np.floor((xiyi - origin)/maxdistance).astype(np.int64)
+        target_keys = np.unique(target_cells[:, 0]*ncells + target_cells[:, 1])
+
+    positions = []
+    coordinates = []
+    for start, (x, y) in xyz_chunks(xyz, ['x', 'y'], chunksize): 
+        if prefilter == None or len(xiyi) == 0: 
+            source = np.arange(len(x))
+        else: 
+            source = np.flatnonzero((x >= xmin) & (x <= xmax) & (y >= ymin) & (y <= ymax))
+        if prefilter == 'hash' and maxdistance > 0 and len(source) > 0: 
+            source_cells = np.floor((np.column_stack((x[source], y[source])) - origin)/maxdistance).astype(np.int64)
+            near = np.zeros(len(source), dtype=bool)
+            for dx in (-1, 0, 1): 
+                for dy in (-1, 0, 1): 
+                    near |= np.isin((source_cells[:, 0] + dx)*ncells + source_cells[:, 1] + dy, target_keys)
+            source = source[near]
+        positions.append(start + source)
+        coordinates.append(np.column_stack((x[source], y[source])))
+    if len(positions) == 0: 
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 2))
+    return np.concatenate(positions), np.concatenate(coordinates)
+
+def load_xyz(filename, cache_dir=None, chunksize=1000000, sep=r'\s+', skiprows=0, binary_dtype=None): 
+    """
+    Memory-mapped xyz points of a survey file, for files larger than memory
+    
+    Input:  filename:     ASCII file with x, y and bedlevel columns, or binary file 
+                          with x, y, bedlevel records of type binary_dtype (e.g. 'f4')
+            cache_dir:    folder of the binary cache (default: folder of filename)
+            chunksize:    number of points read at once
+            sep:          column separator of an ASCII file
+            skiprows:     number of header lines of an ASCII file
+            binary_dtype: type of the values in a binary file, None for an ASCII file
+    
+    Output: memmap with fields 'x', 'y', 'bedlevel', to be used as xyz in SpatialInterpolation 
+            and interpolate_tiled. The file is converted once to a binary cache, which is 
+            reused as long as the file is unchanged. A binary file of little-endian doubles 
+            is mapped directly.
+    """
+    if binary_dtype != None and np.dtype(binary_dtype) == np.dtype('<f8'): 
+        return xyz_memmap(filename)
+
+    cache_dir = cache_dir if cache_dir != None else os.path.dirname(os.path.abspath(filename))
+    status = os.stat(filename)
+    key = hashlib.sha1(f'{os.path.abspath(filename)} {status.st_size} {status.st_mtime_ns} {sep!r} {skiprows} {binary_dtype!r}'.encode()).hexdigest()
+    cache_file = os.path.join(cache_dir, f'xyz_{key}.bin')
+    if not os.path.exists(cache_file): 
+        print(f'Converting {filename} to {cache_file}\n')
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file, so an interrupted conversion is never used as cache
+        temporary_file = f'{cache_file}.{os.getpid()}.tmp'
+        with open(temporary_file, 'wb') as cache: 
+            for chunk in read_xyz_chunks(filename, chunksize, sep, skiprows, binary_dtype): 
+                cache.write(chunk.tobytes())
+        os.replace(temporary_file, cache_file)
+    else: 
+        print(f'Loading {filename} from {cache_file}\n')
+    return xyz_memmap(cache_file)
+
+def xyz_memmap(filename): 
+    """Read-only memmap of a binary file of xyz records"""
+    if os.path.getsize(filename) == 0: 
+        # an empty file cannot be mapped
+        return np.zeros(0, dtype=XYZ_DTYPE)
+    return np.memmap(filename, dtype=XYZ_DTYPE, mode='r')
+
+def read_xyz_chunks(filename, chunksize, sep=r'\s+', skiprows=0, binary_dtype=None): 
+    """Generator of arrays of xyz records with at most chunksize points of an ASCII or binary file"""
+    if binary_dtype != None: 
+        dtype = np.dtype([(name, binary_dtype) for name in XYZ_DTYPE.names])
+        with open(filename, 'rb') as f: 
+            while True: 
+                records = np.fromfile(f, dtype=dtype, count=chunksize)
+                if len(records) == 0: 
+                    return
+                yield records.astype(XYZ_DTYPE)
+
+    for frame in pd.read_csv(filename, sep=sep, skiprows=skiprows, header=None, usecols=[0, 1, 2], 
+                             names=list(XYZ_DTYPE.names), dtype=float, chunksize=chunksize): 
+        chunk = np.empty(len(frame), dtype=XYZ_DTYPE)
+        for name in XYZ_DTYPE.names: 
+            chunk[name] = frame[name].to_numpy()
+        yield chunk
+
+def save_npz(filename, matrix): 
+    """Write a sparse matrix to a .npz cache file through a temporary file, so an interrupted write is never used"""
+    temporary_file = f'{filename[:-len(".npz")]}.{os.getpid()}.tmp.npz'
+    sparse.save_npz(temporary_file, matrix)
+    os.replace(temporary_file, filename)
+
+def xyz_chunks(xyz, fields, chunksize=1000000): 
+    """
+    Generator of (start, arrays) with float arrays of fields (e.g. ['x', 'y']) of at most chunksize points of xyz
+    A memmap of load_xyz is read from its file, so only a chunk is in memory
+    """
+    if isinstance(xyz, np.memmap) and isinstance(xyz.base, mmap.mmap): 
+        with open(xyz.filename, 'rb') as f: 
+            f.seek(xyz.offset)
+            for start in range(0, len(xyz), chunksize): 
+                records = np.fromfile(f, dtype=xyz.dtype, count=min(chunksize, len(xyz) - start))
+                yield start, [records[field].astype(float) for field in fields]
+        return
+    columns = [np.asarray(xyz[field], dtype=float) for field in fields]
+    for start in range(0, len(xyz), chunksize): 
+        yield start, [column[start:start + chunksize] for column in columns]
+
+def xyz_values(xyz, fields, positions, chunksize=1000000): 
+    """Float arrays of fields of xyz at the sorted positions, read chunk by chunk (see xyz_chunks)"""
+    values = [np.empty(len(positions)) for field in fields]
+    for start, arrays in xyz_chunks(xyz, fields, chunksize): 
+        low, high = np.searchsorted(positions, [start, start + len(arrays[0])])
+        for value, array in zip(values, arrays): 
+            value[low:high] = array[positions[low:high] - start]
+    return values
+
+def geometry_key(xiyi, xyz, maxdistance, k, chunksize=1000000): 
+    """Hash of the coordinates of xiyi (m x 2 array) and xyz, hashed chunksize points at a time, maxdistance and k"""
+    key = hashlib.sha1()
+    coordinates = np.ascontiguousarray(xiyi, dtype=float)
+    key.update(str(coordinates.shape).encode())
+    key.update(coordinates)
+    key.update(str((len(xyz), 2)).encode())
+    for _, (x, y) in xyz_chunks(xyz, ['x', 'y'], chunksize): 
+        key.update(np.ascontiguousarray(np.column_stack((x, y))))
+    key.update(f'{maxdistance!r} {k!r}'.encode())
+    return key.hexdigest()
+
+def interpolate_tiled(xiyi, xyz, maxdistance=20., method='idw', tiles=20, workers=None, k=None, power=1., 
+                      chunksize=1000000, tile_dir=None):
+    """
+    Interpolation of xyz on xiyi in tiles, processed in a process pool
     
-  
+    Input:  xiyi:         location_to_interpolate
+                          dataframe containing 2 columns should be named: 'x', 'y'.
+            xyz:          dataframe used in the interpolation. 
+                          Columnnames should contain: 'x', 'y', 'bedlevel'
+                          or memory-mapped xyz file, see load_xyz
+            maxdistance:  float value (in meters) that indicates maximum distance between 
+                          and data_to_interpolate. 
+            method:       interpolation method in [idw, mean, gaussian]
+            tiles:        number of tiles, strips along the longest side of the xiyi bounding box
+                          with an equal number of xiyi points
+            workers:      number of processes (default: number of cpus)
+            k, power:     see SpatialInterpolation and SpatialInterpolation.interpolate
+            chunksize:    number of xyz points assigned to the tiles at once
+            tile_dir:     folder for the temporary tile files (default: system temporary folder)
+    
+    Output: generator of series with the interpolated values of a tile, indexed by the index of xiyi. 
+            The xyz points within maxdistance of a tile (the halo) are written to a file per tile 
+            in a single pass over xyz, chunk by chunk. Only the tiles being processed are in memory. 
+            Use pd.concat to combine the tiles.
+    """
+    xi = np.asarray(xiyi['x'], dtype=float)
+    yi = np.asarray(xiyi['y'], dtype=float)
+
+    # strips along the longest side, ordered along the strip direction
+    swap = np.ptp(xi) < np.ptp(yi) if len(xi) > 0 else False
+    if swap: 
+        xi, yi = yi, xi
+    target_tiles = [np.sort(positions) for positions in np.array_split(np.argsort(xi, kind='stable'), tiles) if len(positions) > 0]
+    bounds = np.array([[xi[positions].min() - maxdistance, xi[positions].max() + maxdistance, 
+                        yi[positions].min() - maxdistance, yi[positions].max() + maxdistance] for positions in target_tiles]).reshape(-1, 4)
+
+    with tempfile.TemporaryDirectory(prefix='smt_tiles_', dir=tile_dir) as folder: 
+        tile_files = [os.path.join(folder, f'tile_{tile}.bin') for tile in range(len(target_tiles))]
+        for tile_file in tile_files: 
+            open(tile_file, 'wb').close()
+        for _, (x, y, z) in xyz_chunks(xyz, ['x', 'y', 'bedlevel'], chunksize): 
+            u, v = (y, x) if swap else (x, y)
+            order = np.argsort(u, kind='stable')
+            u_sorted = u[order]
+            for tile, (umin, umax, vmin, vmax) in enumerate(bounds): 
+                selection = order[np.searchsorted(u_sorted, umin, side='left'):np.searchsorted(u_sorted, umax, side='right')]
+                selection = np.sort(selection[(v[selection] >= vmin) & (v[selection] <= vmax)])
+                if len(selection) == 0: 
+                    continue
+                records = np.empty(len(selection), dtype=XYZ_DTYPE)
+                records['x'] = x[selection]
+                records['y'] = y[selection]
+                records['bedlevel'] = z[selection]
+                with open(tile_files[tile], 'ab') as f: 
+                    f.write(records.tobytes())
+
+        def tile_tasks(): 
+            for positions, tile_file in zip(target_tiles, tile_files): 
+                tile_xyz = load_tile(tile_file)
+                os.remove(tile_file)
+                yield positions, tile_xiyi(xiyi, positions), tile_xyz
+
+        workers = workers or os.cpu_count()
+        if workers == 1: 
+            for positions, tile_points, tile_xyz in tile_tasks(): 
+                yield tile_result(xiyi, positions, interpolate_tile(tile_points, tile_xyz, maxdistance, method, k, power))
+            return
+
+        # keep a limited number of tiles in flight, so memory is bounded by the tiles being processed
+        with ProcessPoolExecutor(max_workers=workers) as executor: 
+            pending = deque()
+            for positions, tile_points, tile_xyz in tile_tasks(): 
+                pending.append((positions, executor.submit(interpolate_tile, tile_points, tile_xyz, maxdistance, method, k, power)))
+                if len(pending) >= 2*workers: 
+                    positions, future = pending.popleft()
+                    yield tile_result(xiyi, positions, future.result())
+            while len(pending) > 0: 
+                positions, future = pending.popleft()
+                yield tile_result(xiyi, positions, future.result())
+
+def tile_xiyi(xiyi, positions): 
+    """xiyi dataframe of a tile"""
+    return pd.DataFrame({'x': np.asarray(xiyi['x'], dtype=float)[positions], 
+                         'y': np.asarray(xiyi['y'], dtype=float)[positions]})
+
+def load_tile(tile_file): 
+    """xyz dataframe of the points in a tile file of interpolate_tiled"""
+    records = np.fromfile(tile_file, dtype=XYZ_DTYPE)
+    return pd.DataFrame({name: records[name] for name in XYZ_DTYPE.names})
+
+def interpolate_tile(tile_xiyi, tile_xyz, maxdistance, method, k=None, power=1.): 
+    """Interpolation of a single tile, returns series indexed by position in the tile"""
+    if len(tile_xyz) == 0: 
+        return pd.Series([], index=pd.Index([], dtype=int, name='i'), name=method, dtype=float)
+    interpolation = SpatialInterpolation(tile_xiyi, tile_xyz, maxdistance, k)
+    interpolation.interpolate(method, power)
+    return interpolation.result
+
+def tile_result(xiyi, positions, result): 
+    """Reindex the result of a tile from positions in the tile to the index of xiyi"""
+    result.index = pd.Index(xiyi.index[positions[result.index.to_numpy()]], name=result.index.name)
+    return result
+
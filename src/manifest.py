@@ -0,0 +1,119 @@
+"""Module for the manifest of the restart information in a database folder"""
+
+#load libraries
+import os
+import logging
+import json
+
+#load modules
+import tools
+
+global logger
+
+# logger, configured by tools.init_logger at the entry point
+logger = logging.getLogger('SMT')
+
+# manifest file in the database folder
+MANIFEST_FILE = 'manifest.json'
+
+# manifests read before, by database: (modification time, entries)
+manifests = {}
+
+def manifest_file(database):
+    """Location of the manifest of database"""
+    return os.path.join(database, MANIFEST_FILE)
+
+def read(database):
+    """
+    Entries of the manifest of database, keyed by restart file (relative to database, without partition number)
+    Returns None if the database has no manifest
+    """
+    filename = manifest_file(database)
+    try:
+        modification_time = os.stat(filename).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if database in manifests and manifests[database][0] == modification_time:
+        return manifests[database][1]
+    with open(filename) as f:
+        entries = json.load(f)['entries']
+    manifests[database] = (modification_time, entries)
+    return entries
+
+def write(database, entries):
+    """Replace the manifest of database atomically"""
+    filename = manifest_file(database)
+    temporary_file = f'{filename}.{os.getpid()}.tmp'
+    with open(temporary_file, 'w') as f:
+        json.dump({'entries': entries}, f, indent=1, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_file, filename)
+    manifests.pop(database, None)
+
+def merge(src, trgt): 
+    """
+    Add the entries of the manifest of database src to the manifest of database trgt,
+    entries of src replace those of trgt for the same restart file. Call after copying the files.
+    """
+    entries = read(src)
+    if entries == None: 
+        return
+    merged = dict(read(trgt) or {})
+    merged.update(entries)
+    write(trgt, merged)
+    logger.info(f'Merged {len(entries)} manifest entries of {src} into {trgt}')
+
+def file_entry(database, filename, checksum):
+    """Entry of a file in database with its size and sha256 checksum"""
+    return {'file': os.path.relpath(filename, database),
+            'size': os.path.getsize(filename),
+            'sha256': checksum}
+
+def register(database, restart_file, file_appendix, partition_files, rtc_file=None):
+    """
+    Add or replace the restart information of a step in the manifest of database
+    restart_file:    restart file relative to database, without partition number
+    partition_files: list of (filename, sha256) of the restart file of every partition
+    rtc_file:        (filename, sha256) of the RTC state file, if any
+    """
+    entries = read(database) or {}
+    entries[restart_file] = {'FileAppendix': file_appendix,
+                             'partitions': len(partition_files),
+                             'files': [file_entry(database, filename, checksum) for filename, checksum in partition_files]}
+    if rtc_file != None:
+        entries[restart_file]['rtc'] = file_entry(database, *rtc_file)
+    write(database, entries)
+
+def lookup(database, restart_file, partition_total):
+    """
+    Check the manifest of database for restart_file with partition_total partitions
+    Returns None if the database has no manifest or restart_file is not registered in it
+    """
+    entries = read(database)
+    if entries == None or restart_file not in entries:
+        return None
+    return entries[restart_file]['partitions'] == partition_total
+
+def verify(database, checksum=True):
+    """
+    Check that the files in the manifest of database exist with the registered size
+    and, if checksum is set, sha256 checksum. Returns a list of problems.
+    """
+    entries = read(database)
+    if entries == None:
+        return [f'{database} has no manifest']
+    problems = []
+    for restart_file, entry in sorted(entries.items()):
+        files = entry['files'] + ([entry['rtc']] if 'rtc' in entry else [])
+        if len(entry['files']) != entry['partitions']:
+            problems.append(f'{restart_file}: {len(entry["files"])} of {entry["partitions"]} partitions registered')
+        for item in files:
+            filename = os.path.join(database, item['file'])
+            if not os.path.exists(filename):
+                problems.append(f'{filename}: missing')
+            elif os.path.getsize(filename) != item['size']:
+                problems.append(f'{filename}: size {os.path.getsize(filename)} instead of {item["size"]}')
+            elif checksum and tools.checksum(filename) != item['sha256']:
+                problems.append(f'{filename}: checksum mismatch')
+    return problems
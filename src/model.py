@@ -2,18 +2,20 @@
 
 import os
 import glob
-from mako.template import Template
+import numbers
+import logging
 from collections import OrderedDict
 import yaml
 import tools
+import timegrid
+import manifest
 from datetime import datetime, timedelta
-import pandas as pd 
-import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 global logger 
 
-# create logger
-logger = tools.init_logger()
+# logger, configured by tools.init_logger at the entry point
+logger = logging.getLogger('SMT')
 
 def read(settings):
     # Read yaml settings file and return dictionary with SMT settings
@@ -61,6 +63,25 @@ def validate(smt_settings):
     simulation_types = ['quasi-steady-hydrograph', 'simulation-list']
     tools.logger_assert(smt_settings['model']['simulation_type'] in simulation_types, f'simulation_type should be one of {simulation_types}')
 
+# parsed from_file tables, stored per filename as (number of rows, dictionary of column arrays)
+from_file_tables = {}
+
+def read_from_file(filename): 
+    """Read a from_file table once and return its length and columns as arrays indexed by TimeIndex"""
+    if filename not in from_file_tables: 
+        import pandas as pd
+        logger.info(f'Reading {filename} ...')
+        df = pd.read_csv(filename)
+        from_file_tables[filename] = (len(df), {key.strip(): df[key].to_numpy() for key in df.keys()})
+    return from_file_tables[filename]
+
+def from_file_row(filename, time_index): 
+    """Return the row of a from_file table for time_index, or None if beyond the last row"""
+    length, columns = read_from_file(filename)
+    if time_index >= length: 
+        return None
+    return {key: column[time_index] for key, column in columns.items()}
+
 def set_input(smt_settings, time_index):
     smt_user = smt_settings['variables']['user']
     user_vars = []
@@ -71,11 +92,10 @@ def set_input(smt_settings, time_index):
         model_settings = {}
         prev_key = ''
         if 'from_file' in user_vars:
-            df = pd.read_csv(smt_user['from_file'])
-            df.rename(columns = dict(zip(df.keys(),list(s.strip() for s  in df.keys()))), inplace=True)
-            if time_index in df.index: 
-                for key in df.keys(): 
-                    model_settings[key] = df[key][time_index]
+            row = from_file_row(smt_user['from_file'], time_index)
+            if row != None: 
+                for key in row.keys(): 
+                    model_settings[key] = row[key]
                     if key == 'TimeDuration': 
                         dependance_map[key] = ''
             else: 
@@ -122,11 +142,9 @@ def set_input(smt_settings, time_index):
         if 'from_file' not in user_vars:
             logger.critical(f'User variable `from_file` not found')
             raise ValueError
-        df = pd.read_csv(smt_user['from_file'])
-        df.rename(columns = dict(zip(df.keys(),list(s.strip() for s  in df.keys()))), inplace=True)
-        if time_index in df.index: 
-            for key in df.keys(): 
-                model_settings[key] = df[key][time_index]
+        row = from_file_row(smt_user['from_file'], time_index)
+        if row != None: 
+            model_settings.update(row)
         else: 
             return None
     else: 
@@ -162,11 +180,15 @@ def set_input(smt_settings, time_index):
 
     return model_settings
 
-def get_input(smt_settings):
-    """Generator for model input"""
+def get_input(smt_settings, planned=None):
+    """
+    Generator for model input
+    planned: set of restart files (relative to local_database) assumed in local_database, for plan.
+             The restart file of every step is added to it.
+    """
 
     time_index = 0
-    time_start = 0.
+    time_start = 0
     model_settings = []
     while True and model_settings != None: 
         model_settings = set_input(smt_settings, time_index)
@@ -204,7 +226,7 @@ def get_input(smt_settings):
                     restart_level = 3
                 
                 # Local database information exists
-                elif partition_path_exists(os.path.join('local_database',restart_file_database), head, partition_total):
+                elif (planned != None and restart_file_database in planned) or restart_exists('local_database', restart_file_database, head, partition_total):
                     logger.info('Restart file found in local_database')
                     model_settings['RestartFileFromBackupLocation'] = os.path.join('local_database',restart_file_database)
                     model_settings['RestartFileToBackupLocation'] = os.path.join('local_database',restart_file_database)
@@ -219,7 +241,7 @@ def get_input(smt_settings):
                 else: 
                     # Local database does not exist and central database does
                     logger.info('Restart file not found in local_database')
-                    if partition_path_exists(os.path.join('central_database',restart_file_database), head, partition_total):
+                    if restart_exists('central_database', restart_file_database, head, partition_total):
                         logger.info('Restart file found in central_database')
                         model_settings['RestartFileFromBackupLocation'] = os.path.join('central_database',restart_file_database)
                         model_settings['RestartFileToBackupLocation'] = os.path.join('local_database',restart_file_database)
@@ -260,20 +282,11 @@ def get_input(smt_settings):
                                 model_settings['RTCFileToBackupLocation'] = os.path.join('local_database',rtc_file_location)
                             restart_level = 3
                 model_settings['RestartLevel'] = restart_level        
+                if planned != None: 
+                    # finalize of this step will put its restart file in local_database
+                    planned.add(restart_file_database)
                 model_settings['SpinupTime'] = model_settings['SpinupTime'][restart_level]
-                model_settings['TStart'] = time_start
-                if model_settings['TUnit'] == 'S':
-                    tunit_in_seconds = 1
-                    time_delta_start = timedelta(seconds = time_start)
-                elif model_settings['TUnit'] == 'M':
-                    tunit_in_seconds = 60
-                    time_delta_start = timedelta(minutes = time_start)
-                elif model_settings['TUnit'] == 'H':
-                    tunit_in_seconds = 3600
-                    time_delta_start = timedelta(hours = time_start)
-                elif model_settings['TUnit'] == 'D':
-                    tunit_in_seconds = 86400
-                    time_delta_start = timedelta(days = time_start)
+                model_settings['TStart'] = float(time_start)
                 if 'MapOutputCount' not in model_settings.keys():
                     model_settings['MapOutputCount'] = 1
                 if 'Dtfacmax' not in model_settings.keys():
@@ -296,40 +309,33 @@ def get_input(smt_settings):
                 #   DtUserModel x Q = SpinUpTimeModel
                 #
                 # To obtain the DtUserModel we search for a DtUserModel which is close to the proposed DtUser in the input file. 
-                maximum_DtUser = model_settings['TimeDuration']*tunit_in_seconds/model_settings['MapOutputCount']
-                model_settings['DtUserModel'] = maximum_DtUser/np.ceil(maximum_DtUser/model_settings['DtUser'])
-
-                #  
-                # Next the SpinupTimeModel is increased to be a multiple of the DtUserModel
-                model_settings['SpinupTimeModel'] = np.ceil(model_settings['SpinupTime']/model_settings['DtUserModel'])*model_settings['DtUserModel']/tunit_in_seconds
-                model_settings['HisIntervalStepModel'] = np.ceil(model_settings['HisIntervalStep']/model_settings['DtUserModel'])*model_settings['DtUserModel']
+                # The time grid is computed with exact fractions, see timegrid.step_times
+                times = timegrid.step_times(time_start, model_settings['TimeDuration'], model_settings['SpinupTime'], model_settings['DtUser'], 
+                                            model_settings['HisIntervalStep'], model_settings['MapOutputCount'], model_settings['TUnit'])
+                model_settings['DtUserModel'] = float(times['DtUserModel'])
+                model_settings['SpinupTimeModel'] = float(times['SpinupTimeModel'])
+                model_settings['HisIntervalStepModel'] = float(times['HisIntervalStepModel'])
                 model_settings['TrtDtModel'] = model_settings['DtUserModel']
 
                 model_settings['MorStt'] = model_settings['SpinupTimeModel']
-                time_stop = time_start + model_settings['TimeDuration'] + model_settings['SpinupTimeModel']
-                model_settings['TStop'] = time_stop
+                model_settings['TStop'] = float(times['TStop'])
                 refdate = datetime.strptime(model_settings['ReferenceDate'], '%Y%m%d')
-                time_start_seconds = time_start*tunit_in_seconds
-                time_start_post_spinup_seconds = np.round((time_start+model_settings['SpinupTimeModel'])*tunit_in_seconds,decimals=16)
-                time_stop_seconds = time_stop*tunit_in_seconds
-                rst_time_duration_post_spinup_seconds = np.round(float(model_settings['TimeDuration'])*tunit_in_seconds,decimals=16)
-                map_time_duration_post_spinup_seconds = np.round(float(model_settings['TimeDuration'])*tunit_in_seconds/float(model_settings['MapOutputCount']),decimals=16)
-                his_time_near_start = time_stop_seconds-np.floor((time_stop_seconds-time_start_seconds)/model_settings['HisIntervalStepModel'])*model_settings['HisIntervalStepModel']
-                validate_output_time(map_time_duration_post_spinup_seconds, model_settings['DtUserModel'], 'MapIntervalStepModel', 'DtUserModel')
-                validate_output_time(time_start_post_spinup_seconds, model_settings['DtUserModel'], 'MapIntervalStart', 'DtUserModel')
-                validate_output_time(time_stop_seconds, model_settings['DtUserModel'], 'MapIntervalStop', 'DtUserModel')
-                model_settings['MapInterval'] = f"{map_time_duration_post_spinup_seconds:.16f} {time_start_post_spinup_seconds:.16f} {time_stop_seconds:.16f}"
-                model_settings['RstInterval'] = f"{rst_time_duration_post_spinup_seconds:.16f} {time_start_post_spinup_seconds:.16f} {time_stop_seconds:.16f}"
-                model_settings['RestartDateTime'] = datetime.strftime(refdate + timedelta(seconds = np.round(time_delta_start.total_seconds())), '%Y%m%d%H%M%S')
-                model_settings['RestartDateTimeStop'] = datetime.strftime(refdate + timedelta(seconds = np.round(time_stop_seconds)), '%Y%m%d_%H%M%S')
-                validate_output_time(his_time_near_start, model_settings['DtUserModel'], 'HisIntervalStart', 'DtUserModel')
-                model_settings['HisInterval'] = f"{model_settings['HisIntervalStepModel']:.16f} {his_time_near_start:.16f} {time_stop_seconds:.16f}"
-                time_start = model_settings['TStop']
+                validate_output_time(times['MapIntervalStep'], times['DtUserModel'], 'MapIntervalStepModel', 'DtUserModel')
+                validate_output_time(times['TStartPostSpinupSeconds'], times['DtUserModel'], 'MapIntervalStart', 'DtUserModel')
+                validate_output_time(times['TStopSeconds'], times['DtUserModel'], 'MapIntervalStop', 'DtUserModel')
+                model_settings['MapInterval'] = timegrid.interval_string(times['MapIntervalStep'], times['TStartPostSpinupSeconds'], times['TStopSeconds'])
+                model_settings['RstInterval'] = timegrid.interval_string(times['RstIntervalStep'], times['TStartPostSpinupSeconds'], times['TStopSeconds'])
+                restart_date_time = refdate + timedelta(seconds = round(times['TStartSeconds']))
+                model_settings['RestartDateTime'] = datetime.strftime(restart_date_time, '%Y%m%d%H%M%S')
+                model_settings['RestartDateTimeStop'] = datetime.strftime(refdate + timedelta(seconds = round(times['TStopSeconds'])), '%Y%m%d_%H%M%S')
+                validate_output_time(times['HisIntervalStart'], times['DtUserModel'], 'HisIntervalStart', 'DtUserModel')
+                model_settings['HisInterval'] = timegrid.interval_string(times['HisIntervalStepModel'], times['HisIntervalStart'], times['TStopSeconds'])
+                time_start = times['TStop']
 
                 model_settings['RestartFile'] = ''
                 model_settings['RestartFileLocation'] = '' # restart_file_database
                 if restart_level < 3: 
-                    restart_file_date_time_string = datetime.strftime(refdate + timedelta(seconds = np.round(time_delta_start.total_seconds())), '%Y%m%d_%H%M%S')
+                    restart_file_date_time_string = datetime.strftime(restart_date_time, '%Y%m%d_%H%M%S')
                     model_settings['RestartFile'] = f'{head}_{restart_file_date_time_string}_rst.nc'
                     if 'DIMR_dflowfm_workdir' in smt_settings['model']:
                         model_settings['RestartFileLocation'] = os.path.join(smt_settings['model']['DIMR_dflowfm_workdir'],model_settings['RestartFile'])  
@@ -344,96 +350,218 @@ def get_input(smt_settings):
         # increase counter 
         time_index += 1
 
-def adapt(model_settings, smt_settings):
-    
-    logger.info('Starting adaptation of source folder')
-    
-    for item in glob.glob('**', recursive=True):
-        if os.path.isfile(item): 
-            head, tail = os.path.split(item)
-            if (tail.find('.template') > 0) and not (head.find('source') > -1): 
-                filename = tail.replace('.template','')
-                file_head, file_ext = os.path.splitext(filename)
-                if file_ext not in smt_settings['application']['input']: 
-                    if file_ext == '.tim':
-                        # TODO: remove this special case
-                        filename_new = ''.join([file_head[:-5], model_settings['FileAppendix'], file_head[-5:]+file_ext])
-                    else: 
-                        filename_new = ''.join([file_head, model_settings['FileAppendix'], file_ext])
-                else:
-                    filename_new = filename
-                full_filename_new = os.path.join(head,filename_new)
-                logger.debug(f'Rendering {full_filename_new}')
-                with open(full_filename_new, 'w') as f:                         
-                    mytemplate = Template(filename=item, strict_undefined=True, input_encoding='utf-8')
-                    f.write(mytemplate.render(**model_settings).replace('\r',''))
-                if file_ext == '.sh': 
-                    os.chmod(full_filename_new, 0o0777)
+def plan(smt_settings): 
+    """
+    Schedule of all steps without running them or touching output, returns (rows, problems)
+    Restart sources are predicted from the databases and the steps before, 
+    the templates of every step are rendered in memory to check them.
+    """
+    import numpy as np
+    module_directory = smt_settings['model'].get('template_cache', None)
+    rows = []
+    problems = []
+    steps = get_input(smt_settings, planned=set())
+    while True: 
+        try: 
+            model_settings = next(steps)
+        except StopIteration: 
+            break
+        except Exception as exc: 
+            # the generator cannot continue after an error
+            problems.append(f'TimeIndex {len(rows)}: {type(exc).__name__}: {exc}')
+            break
+        time_index = model_settings['TimeIndex']
+        for item in get_templates(): 
+            try: 
+                get_template(item, module_directory).render(**model_settings)
+            except Exception as exc: 
+                problems.append(f'TimeIndex {time_index}: {item}: {type(exc).__name__}: {exc}')
+        row = {'TimeIndex': time_index, 
+               'Status': 'skip' if os.path.exists(os.path.join('output', str(time_index))) else 'run'}
+        for key, value in model_settings.items(): 
+            if isinstance(value, np.generic): 
+                # e.g. numpy integers of the from_file table
+                value = value.item()
+            if isinstance(value, (str, numbers.Number)): 
+                row[key] = value
+        rows.append(row)
+    return rows, problems
+
+# folders of the project folder without templates to render
+TEMPLATE_EXCLUDE = ['output', 'local_database', 'central_database']
+
+# template files per project folder and compiled templates per template file
+template_files = {}
+compiled_templates = {}
+
+def get_templates():
+    """Return the template files in the project folder (the current folder), except output and the databases"""
+    project = os.getcwd()
+    if project not in template_files: 
+        templates = []
+        for folder, folders, files in os.walk('.'): 
+            if folder == '.': 
+                folders[:] = [item for item in folders if item not in TEMPLATE_EXCLUDE]
+            templates += [os.path.relpath(os.path.join(folder, item)) for item in files if item.endswith('.template')]
+        template_files[project] = sorted(templates)
+        logger.info(f'Found {len(template_files[project])} template files')
+    return template_files[project]
+
+def get_template(filename, module_directory=None):
+    """Return the compiled mako template for filename, compiling it only once"""
+    key = os.path.abspath(filename)
+    if key not in compiled_templates: 
+        from mako.template import Template
+        compiled_templates[key] = Template(filename=filename, strict_undefined=True, input_encoding='utf-8', 
+                                           module_directory=module_directory)
+    return compiled_templates[key]
+
+def template_folder(template_file, workdir): 
+    """Folder template_file is rendered to: templates in source to the work folder, others in place"""
+    head, _ = os.path.split(template_file)
+    parts = head.split(os.sep)
+    if parts[0] == 'source': 
+        return os.path.join(workdir, *parts[1:])
+    return head
+
+def adapt(model_settings, smt_settings, workdir=os.path.join('output','work')):
+    """Adapt the work folder to the model settings of the current step"""
+
+    logger.info(f'Starting adaptation of {workdir}')
+
+    module_directory = smt_settings['model'].get('template_cache', None)
+    for item in get_templates():
+        _, tail = os.path.split(item)
+        filename = tail.replace('.template','')
+        file_head, file_ext = os.path.splitext(filename)
+        if file_ext not in smt_settings['application']['input']: 
+            if file_ext == '.tim':
+                # TODO: remove this special case
+                filename_new = ''.join([file_head[:-5], model_settings['FileAppendix'], file_head[-5:]+file_ext])
+            else: 
+                filename_new = ''.join([file_head, model_settings['FileAppendix'], file_ext])
+        else:
+            filename_new = filename
+        full_filename_new = os.path.join(template_folder(item, workdir),filename_new)
+        logger.debug(f'Rendering {full_filename_new}')
+        mytemplate = get_template(item, module_directory)
+        if os.path.lexists(full_filename_new): 
+            # never write through a staged link into the source folder
+            os.remove(full_filename_new)
+        with open(full_filename_new, 'w') as f:                         
+            f.write(mytemplate.render(**model_settings).replace('\r',''))
+        if file_ext == '.sh': 
+            os.chmod(full_filename_new, 0o0777)
     if smt_settings['model']['simulation_type'] == 'quasi-steady-hydrograph':
-        if 'DIMR_rtc_workdir' in smt_settings['model']:
-            rtc_new_file = os.path.join('output','work',smt_settings['model']['DIMR_rtc_workdir'],'state_import.xml')
-
-        head, _ = os.path.splitext(smt_settings['model']['input'])
         partition_total, _ = get_partition_total(smt_settings)
+        run_partitions(adapt_partition, partition_total, get_partition_workers(smt_settings), 
+                       model_settings, smt_settings, workdir)
 
-        for partition_number in range(partition_total): 
-            if partition_total == 1: 
-                partition_string = '' 
-            else: 
-                partition_string = f'_{partition_number:04}'
-                            
+        if 'DIMR_rtc_workdir' in smt_settings['model']:
+            rtc_new_file = os.path.join(workdir,smt_settings['model']['DIMR_rtc_workdir'],'state_import.xml')
             if model_settings['RestartLevel'] < 2: 
-                tools.netcdf_copy(model_settings['RestartFileFromBackupLocation'].replace(head, f'{head}{partition_string}'), 
-                                  os.path.join('output','work',model_settings['RestartFileLocation'].replace(head, f'{head}{partition_string}')), 
-                                  smt_settings['model']['exclude_from_database'])
-                if 'DIMR_rtc_workdir' in smt_settings['model']:
-                    tools.remove(rtc_new_file)
-                    tools.copy(model_settings['RTCFileFromBackupLocation'], rtc_new_file)
-                if model_settings['TimeIndex'] > 0: 
-                    files = [rst for rst in glob.glob(f'output/{model_settings["TimeIndex"] - 1}/**/**/{head}{partition_string}**_rst.nc', recursive=True)]
-                    files.sort(key=os.path.getmtime)  
-                    last_output_restart_file = files[-1]
-                    tools.netcdf_append(last_output_restart_file, os.path.join('output','work',model_settings['RestartFileLocation'].replace(head, f'{head}{partition_string}')), 
-                                        smt_settings['model']['exclude_from_database'])
-                    # if 'DIMR_rtc_workdir' in smt_settings['model']:
-                    #     last_output_rtc_file = [rtc for rtc in glob.glob('output/'+str(model_settings['TimeIndex'] - 1)+'/**/**/state_export.xml', recursive=True)][-1]
-                    #     tools.remove(rtc_new_file)
-                    #     tools.copy(last_output_rtc_file, rtc_new_file)                
+                tools.remove(rtc_new_file)
+                tools.copy(model_settings['RTCFileFromBackupLocation'], rtc_new_file)
+                # if model_settings['TimeIndex'] > 0: 
+                #     last_output_rtc_file = [rtc for rtc in glob.glob('output/'+str(model_settings['TimeIndex'] - 1)+'/**/**/state_export.xml', recursive=True)][-1]
+                #     tools.remove(rtc_new_file)
+                #     tools.copy(last_output_rtc_file, rtc_new_file)                
             elif model_settings['RestartLevel'] == 2: 
-                last_output_restart_file = [rst for rst in glob.glob(f'output/{model_settings["TimeIndex"] - 1}/**/**/{head}{partition_string}**_rst.nc', recursive=True)][-1]
-                tools.netcdf_copy(last_output_restart_file, os.path.join('output','work',model_settings['RestartFileLocation'].replace(head, f'{head}{partition_string}')), [])   # copy all data
-                if 'DIMR_rtc_workdir' in smt_settings['model']:
-                    last_output_rtc_file = [rtc for rtc in glob.glob('output/'+str(model_settings['TimeIndex'] - 1)+'/**/**/state_export.xml', recursive=True)][-1]
-                    tools.remove(rtc_new_file)
-                    tools.copy(last_output_rtc_file, rtc_new_file)
-
-
-def finalize(model_settings, smt_settings):
+                last_output_rtc_file = [rtc for rtc in glob.glob('output/'+str(model_settings['TimeIndex'] - 1)+'/**/**/state_export.xml', recursive=True)][-1]
+                tools.remove(rtc_new_file)
+                tools.copy(last_output_rtc_file, rtc_new_file)
+
+def adapt_partition(partition_string, model_settings, smt_settings, workdir): 
+    """Copy restart information of a single partition to the work folder"""
+    head, _ = os.path.splitext(smt_settings['model']['input'])
+    buffer_size = get_netcdf_buffer_size(smt_settings)
+    restart_file_location = os.path.join(workdir,model_settings['RestartFileLocation'].replace(head, f'{head}{partition_string}'))
+
+    if model_settings['RestartLevel'] < 2: 
+        tools.netcdf_copy(model_settings['RestartFileFromBackupLocation'].replace(head, f'{head}{partition_string}'), 
+                          restart_file_location, 
+                          smt_settings['model']['exclude_from_database'], buffer_size)
+        if model_settings['TimeIndex'] > 0: 
+            files = [rst for rst in glob.glob(f'output/{model_settings["TimeIndex"] - 1}/**/**/{head}{partition_string}**_rst.nc', recursive=True)]
+            files.sort(key=os.path.getmtime)  
+            last_output_restart_file = files[-1]
+            tools.netcdf_append(last_output_restart_file, restart_file_location, 
+                                smt_settings['model']['exclude_from_database'], buffer_size)
+    elif model_settings['RestartLevel'] == 2: 
+        last_output_restart_file = [rst for rst in glob.glob(f'output/{model_settings["TimeIndex"] - 1}/**/**/{head}{partition_string}**_rst.nc', recursive=True)][-1]
+        tools.netcdf_copy(last_output_restart_file, restart_file_location, [], buffer_size)   # copy all data
+
+def finalize(model_settings, smt_settings, workdir=os.path.join('output','work')):
     """Finalize model output"""
     
     if smt_settings['model']['simulation_type'] == 'quasi-steady-hydrograph':
-        head, _ = os.path.splitext(smt_settings['model']['input'])
         partition_total, _ = get_partition_total(smt_settings)
-        
-        for partition_number in range(partition_total): 
-            if partition_total == 1: 
-                partition_string = '' 
-            else: 
-                partition_string = f'_{partition_number:04}'
+        partition_files = run_partitions(finalize_partition, partition_total, get_partition_workers(smt_settings), 
+                                         model_settings, smt_settings, workdir)
 
-            # backup restart file to local database
+        rtc_entry = None
+        if 'DIMR_rtc_workdir' in smt_settings['model']:
+            rtc_file = [rtc for rtc in glob.glob(f'{workdir}/**/**/state_export.xml', recursive=True)][-1]
+            tools.copy(rtc_file, model_settings['RTCFileToBackupLocation'])
+            rtc_entry = (model_settings['RTCFileToBackupLocation'], tools.checksum(model_settings['RTCFileToBackupLocation']))
+
+        # register the restart information after all files are in place
+        manifest.register('local_database', os.path.relpath(model_settings['RestartFileToBackupLocation'], 'local_database'), 
+                          model_settings['FileAppendix'], partition_files, rtc_entry)
+
+def finalize_partition(partition_string, model_settings, smt_settings, workdir): 
+    """Backup restart file of a single partition to local database, returns the backup file and its checksum"""
+    head, _ = os.path.splitext(smt_settings['model']['input'])
+    try: 
+        files = glob.glob(f'{workdir}/{model_settings["DIMR_dflowfm_workdir"]}/{model_settings["OutputDir"]}/{head}{partition_string}_{model_settings["RestartDateTimeStop"]}_rst.nc', recursive=True)
+        #files.sort(key=os.path.getmtime)
+        restart_file_database = files[0]  # get last restart time
+    except: 
+        logger.error(f'Check {workdir} folder for error message')
+        raise IndexError(f'Restart file {head}{partition_string}_{model_settings["RestartDateTimeStop"]}_rst.nc not found')
+    backup_file = model_settings['RestartFileToBackupLocation'].replace(head, f'{head}{partition_string}')
+    tools.netcdf_copy(restart_file_database, backup_file,  
+        smt_settings['model']['exclude_from_database'], get_netcdf_buffer_size(smt_settings))
+    return backup_file, tools.checksum(backup_file)
+
+def run_partitions(function, partition_total, workers, *args): 
+    """
+    Call function(partition_string, *args) for every partition, in a process pool if workers > 1
+    Returns the results of function in the order of the partitions
+    """
+    partition_strings = [get_partition_string(partition_number, partition_total) for partition_number in range(partition_total)]
+    results = [None]*partition_total
+    failed = []
+    if workers > 1 and partition_total > 1: 
+        with ProcessPoolExecutor(max_workers=min(workers, partition_total)) as executor: 
+            futures = {executor.submit(function, partition_string, *args): partition_number 
+                       for partition_number, partition_string in enumerate(partition_strings)}
+            for future in as_completed(futures): 
+                if future.exception() != None: 
+                    logger.error(f'{function.__name__} failed for partition {futures[future]}: {future.exception()}')
+                    failed.append(futures[future])
+                else: 
+                    results[futures[future]] = future.result()
+    else: 
+        for partition_number, partition_string in enumerate(partition_strings): 
             try: 
-                files = glob.glob(f'output/work/{model_settings["DIMR_dflowfm_workdir"]}/{model_settings["OutputDir"]}/{head}{partition_string}_{model_settings["RestartDateTimeStop"]}_rst.nc', recursive=True)
-                #files.sort(key=os.path.getmtime)
-                restart_file_database = files[0]  # get last restart time
-            except: 
-                logger.error('Check output/work folder for error message')
-                raise IndexError
-            tools.netcdf_copy(restart_file_database, model_settings['RestartFileToBackupLocation'].replace(head, f'{head}{partition_string}'),  
-                smt_settings['model']['exclude_from_database'])
-            if 'DIMR_rtc_workdir' in smt_settings['model']:
-                rtc_file = [rtc for rtc in glob.glob('output/work/**/**/state_export.xml', recursive=True)][-1]
-                tools.copy(rtc_file, model_settings['RTCFileToBackupLocation'])
+                results[partition_number] = function(partition_string, *args)
+            except Exception as exc: 
+                logger.error(f'{function.__name__} failed for partition {partition_number}: {exc}')
+                raise RuntimeError(f'{function.__name__} failed for partition {partition_number}') from exc
+    if len(failed) > 0: 
+        raise RuntimeError(f'{function.__name__} failed for partitions {sorted(failed)}')
+    return results
+
+def get_partition_string(partition_number, partition_total): 
+    # get partition string for restart file names
+    if partition_total == 1: 
+        return '' 
+    return f'_{partition_number:04}'
+
+def get_partition_workers(smt_settings): 
+    # get number of workers for restart handling of partitions, set by partition_workers
+    return int(smt_settings['model'].get('partition_workers', 1))
 
 def get_partition_total(smt_settings): 
     # get total number of partitions
@@ -448,20 +576,31 @@ def get_partition_total(smt_settings):
 
 
 
+def get_netcdf_buffer_size(smt_settings): 
+    # get memory budget in bytes for netCDF copies, set in MB by netcdf_buffer_mb
+    if 'netcdf_buffer_mb' in smt_settings['model']: 
+        return int(smt_settings['model']['netcdf_buffer_mb']*1024*1024)
+    return tools.NETCDF_BUFFER_SIZE
+
+def restart_exists(database, restart_file, head, partition_total): 
+    """Check if the restart files of all partitions are in database, using its manifest if it registered them"""
+    registered = manifest.lookup(database, restart_file, partition_total)
+    if registered == None: 
+        # not in the manifest, e.g. restart files put in central_database by hand or before it had a manifest
+        return partition_path_exists(os.path.join(database, restart_file), head, partition_total)
+    return registered
+
 def partition_path_exists(restartfile, head, partition_total): 
     path_exists_list = []
     for partition_number in range(partition_total): 
-        if partition_total == 1: 
-            partition_string = '' 
-        else: 
-            partition_string = f'_{partition_number:04}'
+        partition_string = get_partition_string(partition_number, partition_total)
         if not os.path.exists(restartfile.replace(head, f'{head}{partition_string}')): 
             return False
     return True
         
 def validate_output_time(number, factor, number_description, factor_description):
-    if not tools.is_multiple(number, factor):
-        logger.debug(f'{number_description} = {number}')
-        logger.debug(f'{factor_description} = {factor}')
+    if not timegrid.is_multiple(number, factor):
+        logger.debug(f'{number_description} = {float(number)}')
+        logger.debug(f'{factor_description} = {float(factor)}')
         logger.debug(f'{number_description} is not a multple of {factor_description}')
         #raise ValueError(f'{number_description} is not a multple of {factor_description}')
\ No newline at end of file
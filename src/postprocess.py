@@ -0,0 +1,100 @@
+"""Module for background post-processing of finished step output folders"""
+
+#load libraries
+import os
+import logging
+from concurrent.futures import ProcessPoolExecutor
+
+#load modules
+import tools
+
+global logger
+
+# logger, configured by tools.init_logger at the entry point
+logger = logging.getLogger('SMT')
+
+# file written in an output folder when its post-processing is complete
+COMPLETION_MARKER = 'postprocessed.smt'
+
+def postprocess_folder(folder, compress_patterns, complevel, remove_patterns, buffer_size):
+    """Remove scratch files and compress netCDF output in folder, and write the completion marker"""
+    for root, _, files in os.walk(folder):
+        for filename in files:
+            full_filename = os.path.join(root, filename)
+            if tools.matches(filename, remove_patterns):
+                logger.debug(f'Removing {full_filename}')
+                os.remove(full_filename)
+            elif tools.matches(filename, compress_patterns):
+                tools.netcdf_compress(full_filename, complevel, buffer_size)
+    with open(os.path.join(folder, COMPLETION_MARKER), 'w') as f:
+        f.write('post-processing complete\n')
+    return folder
+
+class PostProcessor():
+    """
+    Pool of workers post-processing finished step folders while the next steps run
+
+    Settings from postprocess in the model section of smt.yml (no post-processing if not set):
+        compress:  file patterns of netCDF files to compress (default ['*_map.nc', '*_his.nc'])
+        complevel: zlib compression level (default 4)
+        remove:    file patterns of scratch files to remove (default [])
+        workers:   number of worker processes (default 1)
+    Restart and state files needed by the next step should not be removed.
+    """
+
+    def __init__(self, settings, buffer_size=tools.NETCDF_BUFFER_SIZE):
+        self.settings = settings
+        self.buffer_size = buffer_size
+        self.executor = None
+        self.futures = {}
+        if settings != None:
+            self.executor = ProcessPoolExecutor(max_workers=settings.get('workers', 1))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type != None:
+            # do not hide the original error, leave unfinished folders for the next run
+            if self.executor != None:
+                self.executor.shutdown(wait=True, cancel_futures=True)
+            return False
+        self.wait()
+        return False
+
+    def submit(self, folder):
+        """Queue a finished output folder for post-processing"""
+        if self.executor == None:
+            return
+        logger.info(f'Queueing {folder} for post-processing')
+        self.futures[self.executor.submit(postprocess_folder, folder,
+                                          self.settings.get('compress', ['*_map.nc', '*_his.nc']),
+                                          self.settings.get('complevel', 4),
+                                          self.settings.get('remove', []),
+                                          self.buffer_size)] = folder
+
+    def resume(self, output='output'):
+        """Queue the step folders in output without completion marker, e.g. after an interrupted run"""
+        if self.executor == None or not os.path.exists(output):
+            return
+        for folder in sorted(os.listdir(output)):
+            full_folder = os.path.join(output, folder)
+            if folder.isdigit() and not os.path.exists(os.path.join(full_folder, COMPLETION_MARKER)):
+                self.submit(full_folder)
+
+    def wait(self):
+        """Wait for all queued folders, raises RuntimeError if post-processing of a folder failed"""
+        if self.executor == None:
+            return
+        failed = []
+        for future, folder in self.futures.items():
+            try:
+                future.result()
+                logger.info(f'Finished post-processing {folder}')
+            except Exception as exc:
+                logger.error(f'Post-processing {folder} failed: {exc}')
+                failed.append(folder)
+        self.executor.shutdown()
+        self.futures = {}
+        if len(failed) > 0:
+            raise RuntimeError(f'Post-processing failed for {failed}')
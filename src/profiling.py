@@ -0,0 +1,124 @@
+"""Module for timing and resource use of the phases of the runner"""
+
+#load libraries
+import os
+import logging
+import json
+import time
+import sys
+from datetime import datetime
+try:
+    import resource
+except ImportError:
+    # not available on Windows, only wall time is recorded
+    resource = None
+
+global logger
+
+# logger, configured by tools.init_logger at the entry point
+logger = logging.getLogger('SMT')
+
+# size of the blocks counted by getrusage
+BLOCK_SIZE = 512
+
+def resource_usage():
+    """Wall time, block input and output in bytes and peak RSS in bytes of this process and its finished children"""
+    usage = {'wall_time': time.perf_counter()}
+    if resource != None:
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+        rss_unit = 1 if sys.platform == 'darwin' else 1024
+        usage['read_bytes'] = (own.ru_inblock + children.ru_inblock)*BLOCK_SIZE
+        usage['write_bytes'] = (own.ru_oublock + children.ru_oublock)*BLOCK_SIZE
+        usage['max_rss_bytes'] = max(own.ru_maxrss, children.ru_maxrss)*rss_unit
+    return usage
+
+class Profiler():
+    """
+    Records wall time, bytes read and written and peak RSS per TimeIndex and phase as JSON lines
+    Without filename nothing is recorded. Records are appended line by line, so runs with
+    parallel jobs can share the file.
+    """
+
+    def __init__(self, filename=None):
+        self.filename = filename
+
+    def start(self):
+        """Resource use at the start of a phase"""
+        if self.filename == None:
+            return None
+        return resource_usage()
+
+    def record(self, time_index, phase, start_usage):
+        """Append the resource use of a phase since start_usage to the profile"""
+        if self.filename == None:
+            return
+        usage = resource_usage()
+        record = {'TimeIndex': time_index,
+                  'phase': phase,
+                  'end': datetime.now().strftime('%Y-%m-%dT%H:%M:%S.%f'),
+                  'pid': os.getpid(),
+                  'wall_time_s': usage['wall_time'] - start_usage['wall_time']}
+        if 'read_bytes' in usage:
+            record['read_bytes'] = usage['read_bytes'] - start_usage['read_bytes']
+            record['write_bytes'] = usage['write_bytes'] - start_usage['write_bytes']
+            # peak RSS of this process or a child up to the end of the phase
+            record['max_rss_bytes'] = usage['max_rss_bytes']
+        with open(self.filename, 'a') as f:
+            f.write(json.dumps(record) + '\n')
+
+    def phase(self, time_index, phase):
+        """Context manager recording a phase of step time_index"""
+        return ProfilerPhase(self, time_index, phase)
+
+    def iterate(self, iterable, phase):
+        """Iterate over the model settings of the steps, recording the time to get each of them"""
+        iterator = iter(iterable)
+        while True:
+            start_usage = self.start()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.record(item['TimeIndex'], phase, start_usage)
+            yield item
+
+    def summary(self):
+        """Log a table with the total resource use per phase"""
+        if self.filename == None or not os.path.exists(self.filename):
+            return
+        phases = {}
+        with open(self.filename) as f:
+            for line in f:
+                record = json.loads(line)
+                totals = phases.setdefault(record['phase'], {'count': 0, 'wall_time_s': 0., 'max_s': 0., 'read_bytes': 0, 'write_bytes': 0})
+                totals['count'] += 1
+                totals['wall_time_s'] += record['wall_time_s']
+                totals['max_s'] = max(totals['max_s'], record['wall_time_s'])
+                totals['read_bytes'] += record.get('read_bytes', 0)
+                totals['write_bytes'] += record.get('write_bytes', 0)
+        total_time = sum(totals['wall_time_s'] for totals in phases.values()) or 1.
+        logger.info(f'Profile written to {self.filename}')
+        logger.info(f'{"phase":<12} {"count":>6} {"total s":>10} {"mean s":>10} {"max s":>10} {"read MB":>10} {"written MB":>10} {"share":>6}')
+        for phase, totals in phases.items():
+            logger.info(f'{phase:<12} {totals["count"]:>6} {totals["wall_time_s"]:>10.2f} '
+                        f'{totals["wall_time_s"]/totals["count"]:>10.2f} {totals["max_s"]:>10.2f} '
+                        f'{totals["read_bytes"]/1024**2:>10.1f} {totals["write_bytes"]/1024**2:>10.1f} '
+                        f'{100*totals["wall_time_s"]/total_time:>5.1f}%')
+
+class ProfilerPhase():
+    """Context manager for a phase, see Profiler.phase"""
+
+    def __init__(self, profiler, time_index, phase):
+        self.profiler = profiler
+        self.time_index = time_index
+        self.phase = phase
+
+    def __enter__(self):
+        self.start_usage = self.profiler.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.profiler.record(self.time_index, self.phase, self.start_usage)
+        return False
@@ -2,19 +2,29 @@
 import click
 import logging
 import glob 
-import mako
 import os
 import platform
 import sys 
 import yaml 
 import shutil
+import csv
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 #load modules
 import tools
 import model
+import manifest
+import postprocess
+import profiling
 from application import Application
+from executors import get_executor
+
+# create logger
+logger = tools.init_logger()
 
 def print_version(ctx, param, value):
+    import mako
     import netCDF4
     if not value or ctx.resilient_parsing:
         return
@@ -32,10 +42,13 @@ def print_version(ctx, param, value):
               expose_value=False, is_eager=True, help='Print version information')
 @click.option('-s', '--settings', default='smt.yml', help='SMT settings YAML file (default = smt.yml)')
 @click.option('-c', '--clean', is_flag=True, help='Flag indicating whether previous output and local_database should be cleaned')
-@click.option('-b', '--backup', is_flag=True, help='Flag indicating whether central_database should be replaced by local_database')
-def runner(settings, clean, backup): 
-    # create logger
-    logger = tools.init_logger()
+@click.option('-b', '--backup', is_flag=True, help='Flag indicating whether local_database should be synchronised to central_database: new and changed files are copied and the manifests merged')
+@click.option('--verify', is_flag=True, help='Flag indicating whether local_database and central_database should be checked against their manifests')
+@click.option('--profile', is_flag=True, help='Flag indicating whether time and resource use per step and phase should be written to profile_<date>.jsonl')
+@click.option('-j', '--jobs', default=1, help='Number of simulation-list cases to run in parallel (default = 1)')
+@click.option('--plan', is_flag=False, flag_value='plan.csv', default=None, 
+              help='Check all steps and write their schedule to a CSV file (default = plan.csv) without running them')
+def runner(settings, clean, backup, verify, profile, jobs, plan): 
 
     # read input 
     smt_settings = model.read(settings)
@@ -57,39 +70,143 @@ def runner(settings, clean, backup):
 
     if backup: 
         if smt_settings['model']['simulation_type'] == 'quasi-steady-hydrograph':
-            shutil.copytree('local_database', 'central_database')
+            backup_settings = smt_settings['model'].get('backup', {})
+            tools.sync_tree('local_database', 'central_database', 
+                            compare=backup_settings.get('compare', 'mtime'), 
+                            workers=backup_settings.get('workers', 8), 
+                            exclude_patterns=[manifest.MANIFEST_FILE])
+            # merge the manifests after the files are copied, central_database keeps its own entries
+            manifest.merge('local_database', 'central_database')
         exit()
 
+    if verify: 
+        problems = []
+        for database in ['local_database', 'central_database']: 
+            if manifest.read(database) == None: 
+                logger.info(f'{database} has no manifest, skipping')
+                continue
+            database_problems = manifest.verify(database)
+            for problem in database_problems: 
+                logger.error(problem)
+            logger.info(f'Verified {database}: {len(database_problems)} problem(s)')
+            problems += database_problems
+        sys.exit(1 if len(problems) > 0 else 0)
+
+    if plan != None: 
+        rows, problems = model.plan(smt_settings)
+        write_plan(rows, plan)
+        for problem in problems: 
+            logger.error(problem)
+        logger.info(f'Planned {len(rows)} step(s), {sum(row["Status"] == "run" for row in rows)} to run, '
+                    f'{len(problems)} problem(s), schedule written to {plan}')
+        sys.exit(1 if len(problems) > 0 else 0)
+
     if smt_settings['model']['simulation_type'] == 'quasi-steady-hydrograph':
         tools.guaranteedir('central_database')
         tools.guaranteedir('local_database')
         tools.guaranteedir('output')
 
+    jobs = max(jobs, 1)
+    if jobs > 1 and smt_settings['model']['simulation_type'] != 'simulation-list':
+        logger.warning(f'--jobs is only supported for simulation-list runs, running {smt_settings["model"]["simulation_type"]} sequentially')
+        jobs = 1
+
+    profiler = profiling.Profiler(f'profile_{datetime.now().strftime("%Y%m%d_%H%M%S")}.jsonl' if profile else None)
+    try: 
+        # post-process finished step folders in the background, including those of an interrupted run
+        with postprocess.PostProcessor(smt_settings['model'].get('postprocess', None), 
+                                       model.get_netcdf_buffer_size(smt_settings)) as postprocessor: 
+            postprocessor.resume()
+
+            run_steps(smt_settings, jobs, postprocessor, profiler)
+    finally: 
+        profiler.summary()
+
+def run_steps(smt_settings, jobs, postprocessor, profiler): 
+    """Run the steps without output, for simulation-list jobs cases in parallel"""
+
     # get model input 
-    for model_settings in model.get_input(smt_settings): 
-        # check if output exists from previous run
-        new_output_folder = os.path.join('output', str(model_settings['TimeIndex']))
-        if os.path.exists(new_output_folder): 
-            logger.info(f'Output folder {new_output_folder} exists, skipping ...')
-            continue
-
-        # apply input 
-        if os.path.exists(os.path.join('output','work')):
-            shutil.rmtree(os.path.join('output','work'))
-        shutil.copytree('source',os.path.join('output','work'))
-        model.adapt(model_settings, smt_settings)
-        tools.remove(os.path.join('output','work','**','**.template'))
-   
-        # run model step
-        platform_system = platform.system()
-        app = Application(run_script=smt_settings['application']['command'][platform_system],
-                          run_flags=smt_settings['application']['flags'][platform_system])
-        app.run(os.path.join('output','work'), smt_settings['model']['input'])
-
-        # finalize model step
-        model.finalize(model_settings, smt_settings)
-        shutil.move(os.path.join('output','work'), new_output_folder)
+    if jobs == 1: 
+        for model_settings in profiler.iterate(model.get_input(smt_settings), 'input'): 
+            # check if output exists from previous run
+            if output_exists(model_settings): 
+                continue
+            postprocessor.submit(run_step(model_settings, smt_settings, os.path.join('output','work'), profiler))
+    else: 
+        # simulation-list cases are independent, run each case in its own work folder
+        logger.info(f'Running simulation-list with {jobs} parallel jobs')
+        failed = []
+        with ProcessPoolExecutor(max_workers=jobs) as executor: 
+            futures = {}
+            for model_settings in profiler.iterate(model.get_input(smt_settings), 'input'): 
+                if output_exists(model_settings): 
+                    continue
+                workdir = os.path.join('output', f'work_{model_settings["TimeIndex"]}')
+                futures[executor.submit(run_step, model_settings, smt_settings, workdir, profiler)] = model_settings['TimeIndex']
+            for future in as_completed(futures): 
+                try: 
+                    logger.info(f'Finished case {futures[future]} in {future.result()}')
+                    postprocessor.submit(future.result())
+                except Exception as exc: 
+                    logger.error(f'Case {futures[future]} failed: {exc}')
+                    failed.append(futures[future])
+        if len(failed) > 0: 
+            raise RuntimeError(f'Cases failed: {sorted(failed)}')
+
+def write_plan(rows, filename): 
+    """Log the schedule of model.plan and write it to a CSV file with a column per model setting"""
+    columns = []
+    for row in rows: 
+        columns += [key for key in row.keys() if key not in columns]
+    summary_keys = ['FileAppendix', 'RestartLevel', 'TStart', 'TStop', 'RestartFileFromBackupLocation']
+    for row in rows: 
+        logger.info(f'{row["TimeIndex"]:>5} {row["Status"]:<4} ' + ' '.join(f'{key}={row[key]}' for key in summary_keys if key in row))
+    with open(filename, 'w', newline='') as f: 
+        writer = csv.DictWriter(f, fieldnames=columns)
+        writer.writeheader()
+        writer.writerows(rows)
+
+def output_exists(model_settings): 
+    """Check if output exists from a previous run"""
+    new_output_folder = os.path.join('output', str(model_settings['TimeIndex']))
+    if os.path.exists(new_output_folder): 
+        logger.info(f'Output folder {new_output_folder} exists, skipping ...')
+        return True
+    return False
+
+def run_step(model_settings, smt_settings, workdir, profiler=profiling.Profiler()): 
+    """Run a single model step in workdir and move the result to output/<TimeIndex>"""
+    new_output_folder = os.path.join('output', str(model_settings['TimeIndex']))
+    time_index = model_settings['TimeIndex']
+
+    # apply input 
+    with profiler.phase(time_index, 'stage'): 
+        if os.path.exists(workdir):
+            shutil.rmtree(workdir)
+        staging = smt_settings['model'].get('staging', {})
+        tools.stage('source', workdir, 
+                    mode=staging.get('mode', 'copy'), 
+                    link_patterns=staging.get('link', []), 
+                    copy_patterns=staging.get('copy', []))
+    with profiler.phase(time_index, 'adapt'): 
+        model.adapt(model_settings, smt_settings, workdir)
+
+    # run model step
+    platform_system = platform.system()
+    app = Application(run_script=smt_settings['application']['command'][platform_system],
+                      run_flags=smt_settings['application']['flags'][platform_system], 
+                      timeout=smt_settings['application'].get('timeout', None), 
+                      log_file=smt_settings['application'].get('log_file', 'application.log'), 
+                      executor=get_executor(smt_settings))
+    with profiler.phase(time_index, 'run'): 
+        app.run(workdir, smt_settings['model']['input'])
 
+    # finalize model step
+    with profiler.phase(time_index, 'finalize'): 
+        model.finalize(model_settings, smt_settings, workdir)
+    with profiler.phase(time_index, 'move'): 
+        shutil.move(workdir, new_output_folder)
+    return new_output_folder
 
 if __name__ == '__main__':
     runner()
\ No newline at end of file
@@ -0,0 +1,72 @@
+"""Module for exact time grid arithmetic of hydrograph steps"""
+
+import math
+import numbers
+from fractions import Fraction
+
+# length of the model time units in seconds
+TUNIT_SECONDS = {'S': 1, 'M': 60, 'H': 3600, 'D': 86400}
+
+def exact(value):
+    """Convert a number to a fraction, using the shortest decimal representation of floats"""
+    if isinstance(value, Fraction):
+        return value
+    if isinstance(value, numbers.Integral):
+        return Fraction(int(value))
+    return Fraction(str(float(value)))
+
+def tunit_in_seconds(tunit):
+    """Length of the time unit TUnit in seconds"""
+    if tunit not in TUNIT_SECONDS:
+        raise ValueError(f'TUnit should be one of {list(TUNIT_SECONDS.keys())}')
+    return TUNIT_SECONDS[tunit]
+
+def ceil_multiple(number, factor):
+    """Smallest multiple of factor larger than or equal to number"""
+    return math.ceil(exact(number)/exact(factor))*exact(factor)
+
+def floor_multiple(number, factor):
+    """Largest multiple of factor smaller than or equal to number"""
+    return math.floor(exact(number)/exact(factor))*exact(factor)
+
+def is_multiple(number, factor):
+    """Check if number is an integer multiple of factor"""
+    return (exact(number)/exact(factor)).denominator == 1
+
+def interval_string(step, start, stop):
+    """Interval definition 'step start stop' as used for Map/His/Rst output"""
+    return f'{float(step):.16f} {float(start):.16f} {float(stop):.16f}'
+
+def step_times(time_start, time_duration, spinup_time, dt_user, his_interval_step, map_output_count, tunit):
+    """Time grid of a hydrograph step
+
+    time_start, time_duration and the resulting TStop and SpinupTimeModel are in TUnit,
+    all other times are in seconds. All times are returned as exact fractions.
+
+    The TimeDuration is not altered, the DtUserModel is the largest time step not larger
+    than DtUser for which the map output interval TimeDuration/MapOutputCount is a
+    multiple of DtUserModel. The SpinupTimeModel and HisIntervalStepModel are increased
+    to the next multiple of DtUserModel.
+    """
+    tunit_seconds = tunit_in_seconds(tunit)
+    time_start = exact(time_start)
+    time_duration = exact(time_duration)
+
+    map_interval_step = time_duration*tunit_seconds/exact(map_output_count)
+    dt_user_model = map_interval_step/math.ceil(map_interval_step/exact(dt_user))
+    spinup_time_model = ceil_multiple(spinup_time, dt_user_model)/tunit_seconds
+    his_interval_step_model = ceil_multiple(his_interval_step, dt_user_model)
+    time_stop = time_start + time_duration + spinup_time_model
+
+    time_start_seconds = time_start*tunit_seconds
+    time_stop_seconds = time_stop*tunit_seconds
+    return {'DtUserModel': dt_user_model,
+            'SpinupTimeModel': spinup_time_model,
+            'HisIntervalStepModel': his_interval_step_model,
+            'TStop': time_stop,
+            'MapIntervalStep': map_interval_step,
+            'RstIntervalStep': time_duration*tunit_seconds,
+            'TStartSeconds': time_start_seconds,
+            'TStartPostSpinupSeconds': (time_start + spinup_time_model)*tunit_seconds,
+            'TStopSeconds': time_stop_seconds,
+            'HisIntervalStart': time_stop_seconds - floor_multiple(time_stop_seconds - time_start_seconds, his_interval_step_model)}
@@ -5,22 +5,40 @@ import os
 import logging
 import logging.config
 import glob
-import netCDF4
 from datetime import datetime, timedelta
 import time # for timezone information 
 import shutil
+import fnmatch
 import math 
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 global logger 
 
 # create logger
 def init_logger(): 
-    head,_ = os.path.split(__file__)
-    logging.config.fileConfig(os.path.join(head,'logging.conf'))
-    logger = logging.getLogger('SMT')
-    return logger
+    """Configure logging with logging.conf, once, at the entry point (runsim.py) and return the SMT logger"""
+    global logger_configured
+    if not logger_configured: 
+        head,_ = os.path.split(__file__)
+        logging.config.fileConfig(os.path.join(head,'logging.conf'))
+        logger_configured = True
+    return logging.getLogger('SMT')
 
-logger = init_logger()
+logger_configured = False
+
+# logger, configured by init_logger at the entry point
+logger = logging.getLogger('SMT')
+
+# maximum number of bytes in memory while copying a netCDF variable
+NETCDF_BUFFER_SIZE = 64*1024*1024
+
+# ioctl request to clone a file (linux/fs.h)
+FICLONE = 0x40049409
+
+# coordinates of files without UGRID mesh topology (older D-Flow FM net and restart files)
+UGRID_FALLBACK_COORDINATES = {'node': ['NetNode_x', 'NetNode_y'], 
+                              'face': ['FlowElem_xcc', 'FlowElem_ycc']}
 
 def copy(src, trgt):
     """Recursive copy function from source location to target location"""
@@ -39,6 +57,105 @@ def move(src, trgt):
     else:
         logger.error('Move statement not implemented for OS "' + os.name + '"')
 
+def sync_tree(src, trgt, compare='mtime', workers=8, exclude_patterns=[]): 
+    """
+    Incremental copy of the files in source folder to target folder, like rsync without delete
+    Only files that are new or differ in size and modification time (compare='mtime') or
+    sha256 checksum (compare='checksum') are copied, in a thread pool with workers threads.
+    Every file is copied to a temporary file and renamed, so the target never holds partial files.
+    Files matching exclude_patterns (e.g. a manifest that is merged instead) are not copied.
+    Returns the number of copied files.
+    """
+    if compare not in ['mtime', 'checksum']: 
+        raise ValueError('Compare not in [mtime, checksum]')
+    logger.info(f'Synchronising {src} to {trgt} ...')
+
+    changed = []
+    total = 0
+    for root, _, files in os.walk(src): 
+        for filename in files: 
+            if matches(filename, exclude_patterns): 
+                continue
+            total += 1
+            src_file = os.path.join(root, filename)
+            trgt_file = os.path.join(trgt, os.path.relpath(src_file, src))
+            if sync_needed(src_file, trgt_file, compare): 
+                changed.append((src_file, trgt_file))
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1)) as executor: 
+        for future in [executor.submit(sync_file, src_file, trgt_file) for src_file, trgt_file in changed]: 
+            future.result()
+    logger.info(f'Synchronised {len(changed)} of {total} files from {src} to {trgt}')
+    return len(changed)
+
+def sync_needed(src_file, trgt_file, compare='mtime'): 
+    """Check if src_file is not yet in trgt_file, see sync_tree"""
+    try: 
+        trgt_status = os.stat(trgt_file)
+    except FileNotFoundError: 
+        return True
+    src_status = os.stat(src_file)
+    if src_status.st_size != trgt_status.st_size: 
+        return True
+    if compare == 'mtime': 
+        return src_status.st_mtime_ns != trgt_status.st_mtime_ns
+    return checksum(src_file) != checksum(trgt_file)
+
+def sync_file(src_file, trgt_file): 
+    """Copy src_file with its modification time to trgt_file through a temporary file"""
+    guaranteedir(os.path.dirname(trgt_file))
+    logger.debug(f'Copying {src_file} to {trgt_file} ...')
+    temporary_file = f'{trgt_file}.{os.getpid()}.tmp'
+    shutil.copy2(src_file, temporary_file)
+    os.replace(temporary_file, trgt_file)
+
+def stage(src, trgt, mode='copy', link_patterns=[], copy_patterns=[]):
+    """Stage source folder in target folder, linking static files instead of copying them
+
+    mode: 'copy', 'hardlink', 'symlink' or 'reflink'
+    link_patterns: patterns of files (relative to src) that are linked, only files the model 
+                   never writes, as writing to a hardlink or symlink modifies the source file.
+                   Other files are copied.
+    copy_patterns: patterns of files (relative to src) that are always copied, 
+                   e.g. files that are modified by the model
+    Template files are not staged, these are rendered by model.adapt.
+    """
+    logger.info(f'Staging {src} to {trgt} ({mode}) ...')
+    link_functions = {'copy': shutil.copy2, 'hardlink': os.link, 'symlink': symlink, 'reflink': reflink}
+    if mode not in link_functions: 
+        logger.error(f'Staging mode should be one of {list(link_functions.keys())}')
+        raise ValueError(f'Staging mode should be one of {list(link_functions.keys())}')
+
+    def stage_file(src_file, trgt_file): 
+        filename = os.path.relpath(src_file, src).replace(os.sep, '/')
+        if matches(filename, link_patterns) and not matches(filename, copy_patterns): 
+            try: 
+                return link_functions[mode](src_file, trgt_file)
+            except OSError as err: 
+                logger.debug(f'Cannot {mode} {src_file}, copying instead: {err}')
+        return shutil.copy2(src_file, trgt_file)
+
+    shutil.copytree(src, trgt, copy_function=stage_file, ignore=shutil.ignore_patterns('*.template'))
+
+def matches(filename, patterns): 
+    """Check if filename or its basename matches any of the patterns"""
+    basename = filename.split('/')[-1]
+    return any(fnmatch.fnmatch(filename, pattern) or fnmatch.fnmatch(basename, pattern) for pattern in patterns)
+
+def symlink(src, trgt): 
+    """Symbolic link from target location to the absolute source location"""
+    os.symlink(os.path.abspath(src), trgt)
+
+def reflink(src, trgt): 
+    """Copy-on-write clone of source location to target location (Linux, e.g. btrfs/XFS)"""
+    try: 
+        import fcntl
+    except ImportError: 
+        raise OSError('reflink not supported on this platform')
+    with open(src, 'rb') as fsrc, open(trgt, 'wb') as ftrgt: 
+        fcntl.ioctl(ftrgt.fileno(), FICLONE, fsrc.fileno())
+    shutil.copystat(src, trgt)
+
 def remove(pattern):
     """Recursive delete function according to specified pattern"""
     logger.info('Removing ' + pattern)
@@ -46,11 +163,19 @@ def remove(pattern):
         if os.path.exists(name):
             os.remove(name)
 
+def checksum(filename, block_size=1024*1024): 
+    """sha256 checksum of a file, read in blocks of block_size bytes"""
+    file_hash = hashlib.sha256()
+    with open(filename, 'rb') as f: 
+        for block in iter(lambda: f.read(block_size), b''): 
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
 def guaranteedir(mydir):
     """Make a directory and exit if this is not possible"""
     if not os.path.exists(mydir) and mydir != '':
         logger.info('Creating subdirectory ' + mydir + ' ...')
-        os.mkdir(mydir)
+        os.makedirs(mydir, exist_ok=True)
         if not os.path.isdir(mydir):
             logging.error('Cannot create subdirectory ' + mydir)
 
@@ -61,8 +186,9 @@ def logger_assert(condition, error_message):
         logger.error(error_message)
         raise err
 
-def netcdf_copy(src_netcdf, dst_netcdf, exclude_list): 
-    """ copies src_netcdf to dst_netcdf excluding variables in exclude list """
+def netcdf_copy(src_netcdf, dst_netcdf, exclude_list, buffer_size=NETCDF_BUFFER_SIZE): 
+    """ copies src_netcdf to dst_netcdf excluding variables in exclude list, using at most buffer_size bytes per variable slice """
+    import netCDF4
 
     logger.info('netCDF copy ' + src_netcdf + ' to ' + dst_netcdf + ' ...')
     logger.info('excluding variables '+ ' '.join(exclude_list))
@@ -70,6 +196,10 @@ def netcdf_copy(src_netcdf, dst_netcdf, exclude_list):
     # check that directory exists and otherwise make it
     guaranteedir(os.path.dirname(dst_netcdf))
 
+    # never write through a staged link into the source folder
+    if os.path.lexists(dst_netcdf): 
+        os.remove(dst_netcdf)
+
     # open files for reading and writing 
     with netCDF4.Dataset(src_netcdf, 'r') as src:
         with netCDF4.Dataset(dst_netcdf, 'w') as dst:
@@ -92,17 +222,11 @@ def netcdf_copy(src_netcdf, dst_netcdf, exclude_list):
             for name, variable in src.variables.items():
                 if name in exclude_list: 
                     continue
-                _ = dst.createVariable(name, variable.datatype, variable.dimensions)
-                # copy variable attributes all at once via dictionary
-                #for attrname in variable.ncattrs():
-                #    logger.info("{} -- {}".format(attrname, getattr(variable, attrname)))
-                #print(src.variables[name].__dict__)
-                dst.variables[name].setncatts(src.variables[name].__dict__)
-                # copy data for variable
-                dst.variables[name][:] = src.variables[name][:]
-
-def netcdf_append(src_netcdf, dst_netcdf, append_list): 
-    """ appends variables in exclude list from src_netcdf to dst_netcdf """
+                netcdf_copy_variable(variable, dst, buffer_size)
+
+def netcdf_append(src_netcdf, dst_netcdf, append_list, buffer_size=NETCDF_BUFFER_SIZE): 
+    """ appends variables in exclude list from src_netcdf to dst_netcdf, using at most buffer_size bytes per variable slice """
+    import netCDF4
 
     logger.info('netCDF append ' + src_netcdf + ' to ' + dst_netcdf + ' ...')
     logger.info('for variables '+ ' '.join(append_list))
@@ -125,21 +249,140 @@ def netcdf_append(src_netcdf, dst_netcdf, append_list):
                             dimension2 = src.dimensions[dim_name]
                             dst.createDimension(dim_name, len(dimension2) if not dimension2.isunlimited() else None)
 
-                    _ = dst.createVariable(name, variable.datatype, variable.dimensions)
-                    dst.variables[name][:] = src.variables[name][:]                
-                    # copy variable attributes all at once via dictionary
-                    #for attrname in variable.ncattrs():
-                    #    logger.info("{} -- {}".format(attrname, getattr(variable, attrname)))
-                    dst.variables[name].setncatts(src.variables[name].__dict__)
+                    netcdf_copy_variable(variable, dst, buffer_size)
                 continue
 
+def netcdf_compress(netcdf_file, complevel=4, buffer_size=NETCDF_BUFFER_SIZE): 
+    """ recompresses all variables of netcdf_file in place with zlib at complevel, via a temporary file """
+    import netCDF4
+
+    logger.info(f'netCDF compress {netcdf_file} ...')
+    temporary_file = f'{netcdf_file}.{os.getpid()}.tmp'
+    with netCDF4.Dataset(netcdf_file, 'r') as src:
+        # netCDF3 files are converted to the classic model of netCDF4, which supports compression
+        file_format = 'NETCDF4' if src.data_model == 'NETCDF4' else 'NETCDF4_CLASSIC'
+        with netCDF4.Dataset(temporary_file, 'w', format=file_format) as dst:
+            dst.setncatts(src.__dict__)
+            for name, dimension in src.dimensions.items():
+                dst.createDimension(name, len(dimension) if not dimension.isunlimited() else None)
+            for name, variable in src.variables.items():
+                netcdf_copy_variable(variable, dst, buffer_size, complevel)
+    os.replace(temporary_file, netcdf_file)
+
+def netcdf_copy_variable(variable, dst, buffer_size=NETCDF_BUFFER_SIZE, complevel=None): 
+    """ copies variable to dataset dst, keeping its chunking, compression and attributes, or compressing it with zlib at complevel """
+    import numpy as np
+
+    filters = variable.filters() or {}
+    chunking = variable.chunking()
+    attributes = variable.__dict__.copy()
+    if complevel != None and len(variable.dimensions) > 0 and isinstance(variable.dtype, np.dtype): 
+        filters = {'zlib': True, 'complevel': complevel, 'shuffle': True, 'fletcher32': filters.get('fletcher32', False)}
+    dst_variable = dst.createVariable(variable.name, variable.datatype, variable.dimensions, 
+                                      zlib=filters.get('zlib', False), 
+                                      complevel=filters.get('complevel', 4), 
+                                      shuffle=filters.get('shuffle', True), 
+                                      fletcher32=filters.get('fletcher32', False), 
+                                      chunksizes=chunking if isinstance(chunking, list) else None, 
+                                      fill_value=attributes.pop('_FillValue', None))
+    # copy variable attributes all at once via dictionary
+    dst_variable.setncatts(attributes)
+
+    # copy raw data, without conversion to masked arrays or unpacking of scaled values
+    variable.set_auto_maskandscale(False)
+    dst_variable.set_auto_maskandscale(False)
+    shape = variable.shape
+    if len(shape) == 0: 
+        dst_variable[...] = variable[...]
+        return
+    if 0 in shape: 
+        return
+
+    # copy data in slices along the largest dimension
+    axis = max(range(len(shape)), key=lambda k: shape[k])
+    slice_bytes = getattr(variable.dtype, 'itemsize', 0)*math.prod(shape)//shape[axis]
+    if slice_bytes > 0: 
+        step = max(buffer_size//slice_bytes, 1)
+        if isinstance(chunking, list) and step > chunking[axis]: 
+            # align slices with the chunks of the source
+            step = step//chunking[axis]*chunking[axis]
+    else:
+        # variable length data
+        step = shape[axis]
+    index = [slice(0, n) for n in shape]
+    for start in range(0, shape[axis], step): 
+        index[axis] = slice(start, min(start + step, shape[axis]))
+        dst_variable[tuple(index)] = variable[tuple(index)]
+
+def ugrid_mesh(dataset): 
+    """ name of the 2D mesh topology variable in an open netCDF dataset, None if there is none """
+    for name, variable in dataset.variables.items(): 
+        if getattr(variable, 'cf_role', None) == 'mesh_topology' and getattr(variable, 'topology_dimension', 2) == 2: 
+            return name
+    return None
+
+def ugrid_coordinate_names(dataset, location='node'): 
+    """ mesh topology and names of the x and y variables of the nodes or faces in an open netCDF dataset """
+    if location not in UGRID_FALLBACK_COORDINATES: 
+        raise ValueError(f'UGRID location not in {list(UGRID_FALLBACK_COORDINATES.keys())}')
+    mesh = ugrid_mesh(dataset)
+    if mesh != None and f'{location}_coordinates' in dataset.variables[mesh].ncattrs(): 
+        names = dataset.variables[mesh].getncattr(f'{location}_coordinates').split()
+    else: 
+        names = UGRID_FALLBACK_COORDINATES[location]
+    if len(names) < 2 or not all(name in dataset.variables for name in names[:2]): 
+        raise KeyError(f'No {location} coordinates found in {dataset.filepath()}')
+    return mesh, names[:2]
+
+def ugrid_coordinates(netcdf_file, location='node'): 
+    """ x and y coordinates of the nodes or faces of the 2D mesh in a UGRID netCDF file (net, map or restart file) """
+    import netCDF4
+    with netCDF4.Dataset(netcdf_file, 'r') as dataset: 
+        _, names = ugrid_coordinate_names(dataset, location)
+        coordinates = []
+        for name in names: 
+            dataset.variables[name].set_auto_mask(False)
+            coordinates.append(dataset.variables[name][:])
+    return coordinates
+
+def ugrid_write(netcdf_file, variable_name, values, location='node', fill_value=-999.): 
+    """ 
+    writes values on the nodes or faces in place into variable_name of a UGRID netCDF file 
+    an existing variable keeps its values where values are NaN, a new variable gets fill_value there 
+    for a time dependent variable the last time is written 
+    """
+    import netCDF4
+    import numpy as np
+
+    logger.info(f'UGRID write {variable_name} to {netcdf_file} ...')
+    values = np.asarray(values, dtype=float)
+
+    with netCDF4.Dataset(netcdf_file, 'a') as dataset: 
+        
+        # Update date_modified attribute
+        now = datetime.now()
+        dataset.setncattr('date_modified', now.strftime('%Y-%m-%dT%H:%M:%S') + time.strftime('%z', time.gmtime()))
+
+        mesh, names = ugrid_coordinate_names(dataset, location)
+        if variable_name not in dataset.variables: 
+            variable = dataset.createVariable(variable_name, 'f8', dataset.variables[names[0]].dimensions, fill_value=fill_value)
+            if mesh != None: 
+                variable.mesh = mesh
+            variable.location = location
+            variable.coordinates = ' '.join(names)
+            existing = np.full(values.shape, fill_value)
+        else: 
+            variable = dataset.variables[variable_name]
+            variable.set_auto_maskandscale(False)
+            existing = variable[-1] if variable.ndim > 1 else variable[:]
+
+        if existing.shape != values.shape: 
+            raise ValueError(f'{variable_name} has {existing.size} values on the {location}s, interpolation has {values.size}')
+        values = np.where(np.isnan(values), existing, values)
+        if variable.ndim > 1: 
+            variable[-1] = values
+        else: 
+            variable[:] = values
+
 def divisors(n):
     return [x for x in range(1, n+1) if n % x == 0]
-    
-def is_multiple(number,factor): 
-    c = 0.0 
-    while c < number: 
-        c = c + factor
-        if math.isclose(c, number): 
-            return True
-    return False
\ No newline at end of file
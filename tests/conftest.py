@@ -0,0 +1,16 @@
+"""Test configuration and shared helpers: the modules in src are imported as in runsim.py"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src'))
+
+import tools
+
+def write_restart(database, restart_file, content=b'restart'):
+    """Write a restart file in database and return (filename, sha256)"""
+    filename = os.path.join(database, restart_file)
+    tools.guaranteedir(os.path.dirname(filename))
+    with open(filename, 'wb') as f:
+        f.write(content)
+    return filename, tools.checksum(filename)
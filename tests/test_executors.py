@@ -0,0 +1,68 @@
+"""Tests for the executors of the application command"""
+
+import os
+import time
+import asyncio
+from subprocess import TimeoutExpired
+
+import pytest
+
+import executors
+from executors import LocalExecutor, SlurmExecutor
+
+@pytest.mark.skipif(os.name != 'posix', reason='uses sh')
+def test_local_timeout_after_closing_output(tmp_path):
+    """A process that closes its output and keeps running is killed at the timeout"""
+    log_file = str(tmp_path / 'application.log')
+    command = ['sh', '-c', 'echo started; exec >&- 2>&-; sleep 30']
+    start = time.monotonic()
+    with pytest.raises(TimeoutExpired):
+        asyncio.run(LocalExecutor().run(command, str(tmp_path), log_file, timeout=1))
+    assert time.monotonic() - start < 5
+    with open(log_file) as f:
+        assert f.read() == 'started\n'
+
+@pytest.mark.skipif(os.name != 'posix', reason='uses sh')
+def test_local_exit_code(tmp_path):
+    """The exit code of the command is returned"""
+    log_file = str(tmp_path / 'application.log')
+    assert asyncio.run(LocalExecutor().run(['sh', '-c', 'exit 3'], str(tmp_path), log_file, timeout=10)) == 3
+
+def scheduler(responses):
+    """Stand-in for check_output answering squeue and sacct with the next response for that command"""
+    calls = []
+    async def check_output(*command, timeout=None):
+        calls.append(command[0])
+        return responses[command[0]].pop(0)
+    return check_output, calls
+
+def test_slurm_state_retries_failing_squeue(monkeypatch):
+    """A failing squeue is retried instead of ending the wait for the job"""
+    check_output, calls = scheduler({'squeue': [None, 'RUNNING\n', '\n'], 'sacct': [None]})
+    monkeypatch.setattr(executors, 'check_output', check_output)
+    executor = SlurmExecutor(poll_interval=0)
+    assert asyncio.run(executor.job_state('1')) == 'RUNNING'
+    assert calls == ['squeue', 'sacct', 'squeue']
+    assert asyncio.run(executor.job_state('1')) == None
+
+def test_slurm_state_from_sacct(monkeypatch):
+    """If squeue fails, sacct tells whether the job finished"""
+    check_output, _ = scheduler({'squeue': [None, None], 'sacct': ['CANCELLED by 100\n', 'PENDING\n']})
+    monkeypatch.setattr(executors, 'check_output', check_output)
+    executor = SlurmExecutor(poll_interval=0)
+    assert asyncio.run(executor.job_state('1')) == None
+    assert asyncio.run(executor.job_state('1')) == 'PENDING'
+
+def test_slurm_state_unknown(monkeypatch):
+    """If the scheduler keeps failing the state is an error, not a finished job"""
+    check_output, calls = scheduler({'squeue': [None]*executors.QUERY_ATTEMPTS, 'sacct': [None]*executors.QUERY_ATTEMPTS})
+    monkeypatch.setattr(executors, 'check_output', check_output)
+    with pytest.raises(RuntimeError):
+        asyncio.run(SlurmExecutor(poll_interval=0).job_state('1'))
+    assert len(calls) == 2*executors.QUERY_ATTEMPTS
+
+@pytest.mark.skipif(os.name != 'posix', reason='uses sleep')
+def test_check_output_timeout():
+    """A query that hangs counts as failed"""
+    assert asyncio.run(executors.check_output('sleep', '30', timeout=0.5)) == None
+    assert asyncio.run(executors.check_output('echo', 'ok')) == 'ok\n'
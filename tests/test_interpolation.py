@@ -0,0 +1,73 @@
+"""Tests for the interpolation tools"""
+
+import os
+
+import numpy as np
+import pytest
+import pandas as pd
+
+import interpolation
+
+def make_points(tmp_path, n=20000):
+    """Memory-mapped random xyz points and random xiyi points"""
+    generator = np.random.default_rng(0)
+    records = np.empty(n, dtype=interpolation.XYZ_DTYPE)
+    records['x'] = generator.random(n)*1000
+    records['y'] = generator.random(n)*200
+    records['bedlevel'] = generator.random(n)
+    records.tofile(tmp_path / 'points.bin')
+    xyz = interpolation.load_xyz(str(tmp_path / 'points.bin'), binary_dtype='<f8')
+    xiyi = pd.DataFrame({'x': generator.random(2000)*1000, 'y': generator.random(2000)*200}, index=np.arange(2000)*2)
+    return xiyi, xyz
+
+def test_interpolate_tiled(tmp_path):
+    """Tiles read in chunks give the same result as a single interpolation"""
+    xiyi, xyz = make_points(tmp_path)
+    tile_dir = tmp_path / 'tiles'
+    tile_dir.mkdir()
+    tiled = pd.concat(list(interpolation.interpolate_tiled(xiyi, xyz, 10., tiles=7, workers=1, chunksize=3000, 
+                                                           tile_dir=str(tile_dir)))).sort_index()
+    single = interpolation.SpatialInterpolation(xiyi, xyz, 10.)
+    single.interpolate('idw')
+    assert tiled.index.equals(pd.Index(xiyi.index[single.result.index], name='i'))
+    assert np.allclose(tiled.values, single.result.values)
+    assert os.listdir(tile_dir) == []
+
+def test_prefilter_chunks(tmp_path):
+    """Prefilter and geometry key do not depend on the chunks, memmap and dataframe give the same result"""
+    xiyi, xyz = make_points(tmp_path)
+    frame = pd.DataFrame({name: np.array(xyz[name]) for name in interpolation.XYZ_DTYPE.names})
+    targets = np.column_stack((xiyi['x'], xiyi['y']))[:100]
+    for prefilter in ['bbox', 'hash', None]: 
+        source, xy = interpolation.prefilter_points(targets, xyz, 10., prefilter)
+        chunked_source, chunked_xy = interpolation.prefilter_points(targets, frame, 10., prefilter, chunksize=999)
+        assert np.array_equal(source, chunked_source)
+        assert np.array_equal(xy, np.column_stack((frame['x'], frame['y']))[source])
+        assert np.array_equal(chunked_xy, xy)
+    assert interpolation.geometry_key(targets, xyz, 10., None) == interpolation.geometry_key(targets, frame, 10., None, chunksize=999)
+
+    results = []
+    for points in [xyz, frame]: 
+        single = interpolation.SpatialInterpolation(xiyi.iloc[:100], points, 10., prefilter='hash')
+        results.append(single.interpolate_fields(['bedlevel', 'x']))
+    assert results[0].equals(results[1])
+
+def test_cache_files(tmp_path, monkeypatch):
+    """The neighbour and weight caches are reused, an interrupted write leaves no cache file"""
+    xiyi, xyz = make_points(tmp_path)
+    cache_dir = str(tmp_path / 'cache')
+    first = interpolation.SpatialInterpolation(xiyi.iloc[:100], xyz, 10., cache_dir=cache_dir)
+    first.interpolate('idw')
+    assert sorted(item.split('_')[0] for item in os.listdir(cache_dir)) == ['neighbours', 'weights']
+    second = interpolation.SpatialInterpolation(xiyi.iloc[:100], xyz, 10., cache_dir=cache_dir)
+    second.interpolate('idw')
+    assert second.result.equals(first.result)
+
+    def interrupted(filename, matrix): 
+        with open(filename, 'wb') as f: 
+            f.write(b'PK')
+        raise KeyboardInterrupt
+    monkeypatch.setattr(interpolation.sparse, 'save_npz', interrupted)
+    with pytest.raises(KeyboardInterrupt): 
+        interpolation.SpatialInterpolation(xiyi.iloc[:50], xyz, 10., cache_dir=cache_dir)
+    assert len([item for item in os.listdir(cache_dir) if item.endswith('.npz') and '.tmp' not in item]) == 2
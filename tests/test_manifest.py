@@ -0,0 +1,34 @@
+"""Tests for the manifest of the restart information in a database folder"""
+
+import os
+
+import tools
+import manifest
+from conftest import write_restart
+
+def test_backup_keeps_central_entries(tmp_path):
+    """Synchronising local_database to central_database keeps the entries only central_database has"""
+    local = str(tmp_path / 'local_database')
+    central = str(tmp_path / 'central_database')
+    manifest.register(central, 'river_1000_rst.nc', '_1000', [write_restart(central, 'river_0000_1000_rst.nc', b'old')])
+    manifest.register(central, 'river_2000_rst.nc', '_2000', [write_restart(central, 'river_0000_2000_rst.nc')])
+    manifest.register(local, 'river_2000_rst.nc', '_2000', [write_restart(local, 'river_0000_2000_rst.nc', b'new')])
+    manifest.register(local, 'river_3000_rst.nc', '_3000', [write_restart(local, 'river_0000_3000_rst.nc')])
+
+    tools.sync_tree(local, central, exclude_patterns=[manifest.MANIFEST_FILE])
+    manifest.merge(local, central)
+
+    entries = manifest.read(central)
+    assert sorted(entries.keys()) == ['river_1000_rst.nc', 'river_2000_rst.nc', 'river_3000_rst.nc']
+    assert entries['river_2000_rst.nc']['files'][0]['sha256'] == tools.checksum(os.path.join(local, 'river_0000_2000_rst.nc'))
+    assert manifest.lookup(central, 'river_1000_rst.nc', 1)
+    assert manifest.verify(central) == []
+
+def test_merge_without_local_manifest(tmp_path):
+    """Merging a database without manifest leaves the target manifest untouched"""
+    local = str(tmp_path / 'local_database')
+    central = str(tmp_path / 'central_database')
+    os.makedirs(local)
+    manifest.register(central, 'river_1000_rst.nc', '_1000', [write_restart(central, 'river_0000_1000_rst.nc')])
+    manifest.merge(local, central)
+    assert list(manifest.read(central).keys()) == ['river_1000_rst.nc']
@@ -0,0 +1,84 @@
+"""Tests for the model preparation"""
+
+import os
+import csv
+
+import model
+import manifest
+from conftest import write_restart
+
+def test_restart_exists_unregistered(tmp_path):
+    """Restart files missing from the manifest of a database are found on disk"""
+    database = str(tmp_path / 'central_database')
+    manifest.register(database, 'river_1000_rst.nc', '_1000',
+                      [write_restart(database, f'river_000{partition}_1000_rst.nc') for partition in range(2)])
+    for partition in range(2):
+        write_restart(database, f'river_000{partition}_2000_rst.nc')
+
+    assert model.restart_exists(database, 'river_1000_rst.nc', 'river', 2)
+    assert model.restart_exists(database, 'river_2000_rst.nc', 'river', 2)
+    assert not model.restart_exists(database, 'river_3000_rst.nc', 'river', 2)
+    # registered with a different number of partitions
+    assert not model.restart_exists(database, 'river_1000_rst.nc', 'river', 4)
+
+SMT_YML = """model:
+  simulation_type: quasi-steady-hydrograph
+  input: river.mdu
+  load_from_database: True
+application:
+  input: ['.mdu']
+  command:
+    Linux: ['true']
+  flags:
+    Linux: []
+variables:
+  automatic:
+  user:
+    from_file: hydrograph.csv
+    nNodes: 1
+    nProc: 2
+    TUnit: 'H'
+    DtUser: 3600
+    HisIntervalStep: 600
+    ReferenceDate: '20200101'
+    SpinupTime: [0, 3600, 7200, 7200]
+"""
+
+def test_plan_csv(tmp_path, monkeypatch):
+    """The plan has a row per step with the from_file columns, without creating output or databases"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'smt.yml').write_text(SMT_YML)
+    (tmp_path / 'hydrograph.csv').write_text('Q, TimeDuration\n1000, 24\n2000, 48\n1000, 24\n')
+    (tmp_path / 'source').mkdir()
+    (tmp_path / 'source' / 'river.mdu.template').write_text('Q = ${Q}\nTStart = ${TStart}\nTStop = ${TStop}\n')
+    import runsim
+
+    rows, problems = model.plan(model.read('smt.yml'))
+    runsim.write_plan(rows, 'plan.csv')
+
+    assert problems == []
+    assert [row['RestartLevel'] for row in rows] == [3, 2, 0]
+    with open('plan.csv') as f:
+        table = list(csv.DictReader(f))
+    assert [row['Q'] for row in table] == ['1000', '2000', '1000']
+    assert [row['TimeDuration'] for row in table] == ['24', '48', '24']
+    assert not os.path.exists('output')
+    assert not os.path.exists('local_database')
+
+def test_adapt_templates(tmp_path, monkeypatch):
+    """Templates in source are rendered to the work folder, others in place, those in output are ignored"""
+    monkeypatch.chdir(tmp_path)
+    for folder in ['source', 'boundary_conditions', os.path.join('output', '0'), os.path.join('output', 'work')]:
+        os.makedirs(folder)
+    (tmp_path / 'source' / 'model.mdu.template').write_text('Q = ${Q}\n')
+    (tmp_path / 'boundary_conditions' / 'inflow.bc.template').write_text('${Q}\n')
+    (tmp_path / 'output' / '0' / 'old.bc.template').write_text('${Undefined}\n')
+    smt_settings = {'model': {'simulation_type': 'simulation-list'}, 'application': {'input': ['.mdu']}}
+
+    for q in [1000, 2000]:
+        model.adapt({'Q': q, 'FileAppendix': f'_{q}'}, smt_settings, os.path.join('output', 'work'))
+
+    assert (tmp_path / 'output' / 'work' / 'model.mdu').read_text() == 'Q = 2000\n'
+    assert (tmp_path / 'boundary_conditions' / 'inflow_1000.bc').read_text() == '1000\n'
+    assert (tmp_path / 'boundary_conditions' / 'inflow_2000.bc').read_text() == '2000\n'
+    assert not os.path.exists(tmp_path / 'output' / '0' / 'old_1000.bc')
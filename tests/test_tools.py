@@ -0,0 +1,33 @@
+"""Tests for the helper tools"""
+
+import os
+
+import tools
+
+def make_source(tmp_path):
+    """Source folder with a static file and a template"""
+    source = tmp_path / 'source'
+    source.mkdir()
+    (source / 'static.dat').write_text('original\n')
+    (source / 'river.mdu.template').write_text('${Q}\n')
+    return str(source)
+
+def test_stage_default_copies(tmp_path):
+    """Without link patterns, writing to a staged file leaves the source file unchanged"""
+    source = make_source(tmp_path)
+    work = str(tmp_path / 'work')
+    tools.stage(source, work, mode='hardlink')
+    with open(os.path.join(work, 'static.dat'), 'w') as f:
+        f.write('modified by the model\n')
+    with open(os.path.join(source, 'static.dat')) as f:
+        assert f.read() == 'original\n'
+    assert not os.path.exists(os.path.join(work, 'river.mdu.template'))
+
+def test_stage_link_patterns(tmp_path):
+    """Files matching the link patterns are linked, unless they match the copy patterns"""
+    source = make_source(tmp_path)
+    (tmp_path / 'source' / 'solver.ini').write_text('[solver]\n')
+    work = str(tmp_path / 'work')
+    tools.stage(source, work, mode='hardlink', link_patterns=['*'], copy_patterns=['*.ini'])
+    assert os.path.samefile(os.path.join(source, 'static.dat'), os.path.join(work, 'static.dat'))
+    assert not os.path.samefile(os.path.join(source, 'solver.ini'), os.path.join(work, 'solver.ini'))